@@ -0,0 +1,117 @@
+import os
+import csv
+import argparse
+import threading
+import statistics
+from time import perf_counter
+from dotenv import load_dotenv, find_dotenv
+
+# Timings must come from the model, not the response cache
+os.environ.setdefault("LLM_CACHE", "0")
+
+from modules.backend import get_llm, get_embedding
+from modules.vector_db import check_and_load_vector_db
+from modules.batch_retrieval import PrefetchedRetriever
+from modules.chains import build_qa
+from modules.evaluation import apply_concurrently
+from modules.instrumentation import to_ms
+from modules.synthetic_catalog import generate_catalog, generate_queries
+from modules.data_viz import scaling_curves
+
+# Every point varies one parameter from this baseline
+BASELINE = {"rows": 1000, "k": 4, "description_words": 60, "complexity": 1}
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)] if values else None
+
+def run_point(params, strategies, llm, embedding, data_dir, num_queries, limiter, max_concurrency):
+    """
+    Benchmarks every strategy at one point of the sweep.
+    Returns one row per strategy with the index build, retrieval and per-query figures.
+    """
+    file_path = generate_catalog(data_dir, params["rows"], params["description_words"])
+
+    start = perf_counter()
+    db = check_and_load_vector_db(file_path, embedding)
+    index_ms = to_ms(perf_counter() - start)
+
+    queries = generate_queries(file_path, num_queries, params["complexity"])
+    start = perf_counter()
+    retriever = PrefetchedRetriever.from_queries(db, queries, k=params["k"])
+    retrieval_ms = to_ms(perf_counter() - start)
+
+    rows = []
+    for chain_type in strategies:
+        qa = build_qa(llm, chain_type, retriever, verbose=False, limiter=limiter)
+        start = perf_counter()
+        _, measurements = apply_concurrently(qa, [{"query": q} for q in queries], limiter, max_concurrency=max_concurrency)
+        wall = perf_counter() - start
+
+        times = [m["time"] for m in measurements]
+        tokens = [m["prompt_tokens"] + m["completion_tokens"] for m in measurements]
+        rows.append({
+            **params,
+            "chain_type": chain_type,
+            "queries": len(queries),
+            "index_ms": index_ms,
+            "retrieval_ms": retrieval_ms,
+            "mean_ms": statistics.mean(times),
+            "p50_ms": percentile(times, 50),
+            "p90_ms": percentile(times, 90),
+            "mean_tokens": statistics.mean(tokens),
+            "mean_prompt_tokens": statistics.mean(m["prompt_tokens"] for m in measurements),
+            "mean_llm_calls": statistics.mean(len(m["llm_calls"]) for m in measurements),
+            "llm_errors": sum(1 for m in measurements for span in m["llm_calls"] if span.get("error")),
+            "throughput_qps": len(queries) / wall if wall else None,
+        })
+        print(f"{params} {chain_type}: {rows[-1]['mean_ms']:.03f}ms mean, {rows[-1]['mean_tokens']:.0f} tokens, {rows[-1]['throughput_qps']:.2f} q/s")
+    return rows
+
+def sweep_points(sweeps):
+    """One point per swept value, the other parameters held at the baseline."""
+    points = [dict(BASELINE)]
+    for param, values in sweeps.items():
+        for value in values:
+            point = {**BASELINE, param: value}
+            if point not in points:
+                points.append(point)
+    return points
+
+def write_rows(rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Benchmark results written to {path}")
+
+def main():
+    _ = load_dotenv(find_dotenv()) # read local .env file
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the chunking strategies on synthetic catalogs.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000, 1000000], help="catalog sizes")
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 8, 16], help="documents retrieved per query")
+    parser.add_argument("--description-words", type=int, nargs="+", default=[30, 60, 240, 960], help="document lengths")
+    parser.add_argument("--complexity", type=int, nargs="+", default=[1, 2, 3], help="query complexity levels (1-3)")
+    parser.add_argument("--strategies", nargs="+", default=["stuff", "map_reduce", "refine", "map_rerank"])
+    parser.add_argument("--queries", type=int, default=5, help="queries per point")
+    parser.add_argument("--data-dir", default="data/synthetic")
+    parser.add_argument("--out-dir", default="results")
+    args = parser.parse_args()
+
+    sweeps = {"rows": args.rows, "k": args.k, "description_words": args.description_words, "complexity": args.complexity}
+    llm = get_llm(temperature = 0.0)
+    embedding = get_embedding()
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", 4))
+    limiter = threading.BoundedSemaphore(max_concurrency)
+
+    rows = []
+    for params in sweep_points(sweeps):
+        rows.extend(run_point(params, args.strategies, llm, embedding, args.data_dir, args.queries, limiter, max_concurrency))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_rows(rows, os.path.join(args.out_dir, "benchmark.csv"))
+    for param in sweeps:
+        scaling_curves(rows, param, BASELINE, os.path.join(args.out_dir, f"benchmark_{param}.png"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+import tempfile
+
+# Catalog shapes CatalogReader must read exactly as CSVLoader does
+EDGE_CASES = {
+    "trailing_blank_line": ',name,description\n0,Beanie,"Warm, soft"\n1,Jacket,Waterproof\n\n',
+    "blank_line_mid_file": ',name,description\n0,Beanie,"Warm, soft"\n\n1,Jacket,Waterproof\n2,Mat,Recycled\n',
+    "crlf_and_quoted_newline": ',name,description\r\n0,Beanie,"Warm,\r\nsoft"\r\n\r\n1,Jacket,Waterproof\r\n',
+    "whitespace_line": ',name,description\n0,Beanie,Warm\n  \n1,Jacket,Waterproof\n',
+}
+
+def compare(file_path):
+    """Differences between CatalogReader (streamed and indexed) and CSVLoader on one CSV, as messages."""
+    from langchain_community.document_loaders import CSVLoader
+    from modules.catalog import CatalogReader
+
+    expected = [(doc.page_content, doc.metadata) for doc in CSVLoader(file_path).load()]
+    reader = CatalogReader(file_path)
+    streamed = [(doc.page_content, doc.metadata) for doc in reader.lazy_load()]
+    indexed = [(doc.page_content, doc.metadata) for doc in reader[:]]
+    problems = []
+    for name, docs in (("lazy_load", streamed), ("index", indexed)):
+        if len(docs) != len(expected):
+            problems.append(f"{name}: {len(docs)} rows, CSVLoader {len(expected)}")
+        problems.extend(f"{name}: row {i} differs" for i, (got, want) in enumerate(zip(docs, expected)) if got != want)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks CatalogReader against LangChain's CSVLoader, a guard for the vector DB's row hashes.")
+    parser.add_argument("files", nargs="*", help="catalog CSVs to check, besides the built-in edge cases")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = []
+        for name, text in EDGE_CASES.items():
+            path = os.path.join(tmp_dir, f"{name}.csv")
+            with open(path, "w", encoding="utf-8", newline="") as file:
+                file.write(text)
+            cases.append((name, path))
+        cases.extend((path, path) for path in args.files)
+
+        for name, path in cases:
+            problems = compare(path)
+            print(f"{'FAIL' if problems else 'ok'}: {name}")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Loaded only once they are needed; importing an entry point must not pull them in
+HEAVY_MODULES = ["matplotlib", "pandas", "numpy", "chromadb", "langchain_core", "langchain.chains", "langchain_openai", "langchain_community.vectorstores", "langchain.evaluation", "langchain.indexes"]
+
+# The CLI, and what every spawned worker of a sharded run imports before it is set up
+ENTRY_POINTS = ["main", "modules.sharded_runner"]
+
+# Runs in a fresh interpreter: times the import and lists what it loaded
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(",".join(sys.modules))
+"""
+
+def direct_imports(stderr, module):
+    """
+    Cumulative import time (ms) of each module imported directly by module, from
+    python -X importtime output. A module's imports are listed just before it, indented
+    one level (two spaces) deeper per level of nesting.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            entries.append(((len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative) / 10**3))
+
+    ends = [i for i, (level, name, _) in enumerate(entries) if level == 0 and name == module]
+    if not ends:
+        return {}
+    times, i = {}, ends[-1] - 1
+    while i >= 0 and entries[i][0] > 0:
+        if entries[i][0] == 1:
+            times[entries[i][1]] = entries[i][2]
+        i -= 1
+    return times
+
+def measure(module, cwd):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    )
+    seconds, loaded = completed.stdout.strip().splitlines()[-2:]
+    return float(seconds) * 10**3, set(loaded.split(",")), direct_imports(completed.stderr, module)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the entry points, a guard against slow cold starts.")
+    parser.add_argument("--module", nargs="+", default=ENTRY_POINTS, help="modules to import, each in its own interpreters")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time (the median is reported)")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 150)), help="fail above this median import time")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    failed = False
+    for module in args.module:
+        runs = [measure(module, cwd) for _ in range(args.runs)]
+        median = statistics.median(ms for ms, _, _ in runs)
+        _, loaded, times = runs[-1]
+
+        print(f"import {module}: median {median:.1f}ms over {args.runs} runs (budget {args.budget_ms:.0f}ms)")
+        for name, ms in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {ms:8.1f}ms  {name}")
+
+        eager = [name for name in HEAVY_MODULES if name in loaded]
+        if eager:
+            print(f"FAIL: importing {module} loads {', '.join(eager)}; import them where they are used")
+        if median > args.budget_ms:
+            print(f"FAIL: import time {median:.1f}ms is over the {args.budget_ms:.0f}ms budget")
+        failed = failed or bool(eager) or median > args.budget_ms
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
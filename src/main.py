@@ -1,58 +1,98 @@
+import os
 from dotenv import load_dotenv, find_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_openai.embeddings import OpenAIEmbeddings
-from modules.set_model import llm_model
-from modules.evaluation import generate_qas, evaluate
-from modules.markdown_file_gen import results_data_to_markdown_table, write_markdown_table_to_file
-from modules.vector_db import check_and_load_vector_db
-from modules.qa_analysis import qa_analysis
-from modules.data_viz import data_viz
+
+# Heavy dependencies (LangChain chains, Chroma, pandas, matplotlib) are imported where they are
+# first needed, so the entry point starts fast; import_benchmark.py keeps it that way
 
 def main():
+    from modules.backend import get_llm, get_embedding
+    from modules.llm_cache import get_llm_cache
+    from modules.runner import run_strategies
+    from modules.results_data import ResultsStore
+    from modules.run_journal import RunJournal
+    from modules.metrics import start_metrics_exporter
+    from modules.profiling import get_profiler, profile_phase
+    from modules.markdown_file_gen import results_data_to_markdown_table, latency_summary_to_markdown_table, write_markdown_table_to_file
+    from modules.vector_db import check_and_load_vector_db
+
     # Basic Setup
     _ = load_dotenv(find_dotenv()) # read local .env file
-    results_data = []
-    strategies = ["stuff", "map_reduce", "refine", "map_rerank"]
+    results_data = ResultsStore()
+    strategies = ["stuff", "map_reduce", "refine", "map_rerank", "auto", "packed_refine", "gated_refine", "early_exit_map_rerank"]
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY", 4)) # global cap on LLM calls in flight
+    trials = int(os.getenv("TRIALS", 1)) # repeated runs of every example, for latency percentiles
+    warmups = int(os.getenv("WARMUP_TRIALS", 1 if trials > 1 else 0)) # discarded runs before the trials
+    processes = int(os.getenv("PROCESSES", 1)) # worker processes; more than one shards the evaluation
 
     # Load data into vector db or use existing one
     file_path = 'data/OutdoorClothingCatalog_1000.csv'
-    embedding = OpenAIEmbeddings()  # Define embedding
+    embedding = get_embedding()  # Define embedding (LLM_BACKEND=fake runs offline)
 
     # Check if vector DB exists for the CSV, and load or create accordingly
-    db = check_and_load_vector_db(file_path, embedding)
+    with profile_phase("vector_db_open"):
+        db = check_and_load_vector_db(file_path, embedding)
 
     queries = ["Please suggest a shirt with sunblocking", "Please suggest a shirt with sunblocking and tell me why this one", "Please suggest three shirts with sunblocking and tell me why. Give this back to me in markdown code as a table", "Please suggest three shirts with sunblocking and tell me why. Give this back to me in markdown code as a table, with a summary below outlining why sunblocking is important"]
 
     # Configure LLM for querying
     # layers vector db on llm to inform decisions and responses
-    llm = ChatOpenAI(temperature = 0.0, model=llm_model())
+    llm = get_llm(temperature = 0.0)
     retriever = db.as_retriever()
 
     # Manual analysis - TODO: add answers
+    # from modules.qa_analysis import qa_analysis
     # for index, query in enumerate(queries, start=1):
     #     results_data = qa_analysis(llm, "stuff", retriever, True, query, index, results_data)
     #     results_data = qa_analysis(llm, "map_reduce", retriever, True, query, index, results_data)
     #     results_data = qa_analysis(llm, "refine", retriever, True, query, index, results_data)
     #     results_data = qa_analysis(llm, "map_rerank", retriever, True, query, index, results_data)
 
-    # LLM QA Gen AND Evaluate
-    for strat in strategies:
-        # Generate evaluation Q&As
-        tuple = generate_qas(file_path, db, llm, strat) #TODO: change this?
-        qa = tuple[0]
-        examples = tuple[1]
+    # Every result is journalled as it completes, so a run that dies resumes where it stopped
+    journal = RunJournal(os.getenv("RUN_JOURNAL", "results/run.journal.jsonl"))
+
+    # Live metrics (METRICS_PORT and/or METRICS_FILE), to watch a long run as it goes
+    exporter = start_metrics_exporter()
+
+    # LLM QA Gen AND Evaluate, all strategies concurrently
+    if processes > 1:
+        # Sharded across worker processes, which share the NumPy index (VECTOR_STORE=numpy) memory-mapped
+        from modules.sharded_runner import run_sharded
+        results_data = run_sharded(strategies, file_path, db, results_data, max_concurrency, journal, trials, warmups, processes)
+    else:
+        results_data = run_strategies(strategies, file_path, db, llm, results_data, max_concurrency, journal, trials, warmups)
+
+    # Report how many LLM calls were served from the response cache
+    cache = get_llm_cache()
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+
+    with profile_phase("report"):
+        # Generate results in markdown, with the latency percentiles across trials
+        md_table = latency_summary_to_markdown_table(results_data) + "\n" + results_data_to_markdown_table(results_data)
+
+        # Write results to file
+        write_markdown_table_to_file(md_table, "results.md")
+
+        # Keep the full results, typed, for later analysis
+        try:
+            results_data.save("results/results.parquet")
+        except ImportError as e:
+            print(f"Results not saved as Parquet (needs pyarrow): {e}")
 
-        # Evaluate 
-        results_data = evaluate(strat, qa, examples, llm, results_data)
+        # Visualise results; matplotlib is only loaded now
+        from modules.data_viz import data_viz
+        data_viz(results_data)
 
-    # Generate results in markdown
-    md_table = results_data_to_markdown_table(results_data)
+    # The run finished, so the next one starts afresh
+    print(f"Run journal archived to {journal.archive()}")
 
-    # Write results to file
-    write_markdown_table_to_file(md_table, "results.md")
+    if exporter is not None:
+        exporter.stop()
 
-    # Visualise results
-    data_viz(results_data)
+    # Per-phase cProfile stats and a flamegraph of the client-side work (PROFILE_DIR, e.g. results/profile)
+    profiler = get_profiler()
+    if profiler is not None:
+        print(f"Profiles written to {profiler.dump()}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,53 @@
+import os
+from langchain_core.embeddings import Embeddings
+from modules.set_model import llm_model
+from modules.llm_cache import get_llm_cache
+from modules.profiling import get_profiler, profile_phase
+
+# Picks the LLM and embedding implementation: "openai" (default) or the offline "fake" backend
+
+def backend_name():
+    return os.getenv("LLM_BACKEND", "openai").lower()
+
+def get_llm(temperature=0.0, model=None):
+    """
+    Returns the chat model for the configured backend, backed by the persistent response cache
+    and charging each call to the shared rate limiter, when RATE_LIMIT_RPM or RATE_LIMIT_TPM is set.
+    """
+    from modules.rate_limit import get_rate_limiter, RateLimitCallbackHandler
+    cache = get_llm_cache()
+    rate_limiter = get_rate_limiter()
+    callbacks = [RateLimitCallbackHandler(rate_limiter)] if rate_limiter is not None else None
+    if backend_name() == "fake":
+        from modules.fake_backend import FakeChatModel
+        return FakeChatModel(temperature=temperature, cache=cache, callbacks=callbacks)
+
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(temperature=temperature, model=model or llm_model(), cache=cache, callbacks=callbacks)
+
+class ProfiledEmbeddings(Embeddings):
+    """Delegates to another embedding model, profiling every call as the 'embedding' phase."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
+
+    def embed_documents(self, texts):
+        with profile_phase("embedding"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        with profile_phase("embedding"):
+            return self.embeddings.embed_query(text)
+
+def get_embedding():
+    """Returns the embedding model for the configured backend, profiled as its own phase when profiling."""
+    if backend_name() == "fake":
+        from modules.fake_backend import HashingEmbeddings
+        embedding = HashingEmbeddings()
+    else:
+        from langchain_openai.embeddings import OpenAIEmbeddings
+        embedding = OpenAIEmbeddings()
+    return ProfiledEmbeddings(embedding) if get_profiler() is not None else embedding
@@ -0,0 +1,136 @@
+import os
+import re
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import PromptTemplate
+from modules.instrumentation import LatencyCallbackHandler
+from modules.tokens import count_tokens
+from modules.profiling import profiled
+
+# QAEvalChain's grading prompt, for many submissions at once with one verdict line each
+BATCH_GRADE_TEMPLATE = """You are a teacher grading a quiz.
+You are given a numbered list of items, each with a question, the student's answer, and the true answer, and are asked to score every student answer as either CORRECT or INCORRECT.
+
+Example Format:
+ITEM 1
+QUESTION: question here
+STUDENT ANSWER: student's answer here
+TRUE ANSWER: true answer here
+
+Grade the student answers based ONLY on their factual accuracy. Ignore differences in punctuation and phrasing between the student answer and true answer. It is OK if the student answer contains more information than the true answer, as long as it does not contain any conflicting statements. Grade every item on its own. Begin!
+
+{items}
+Reply with exactly one line per item, in the form
+ITEM <number>: CORRECT or INCORRECT
+GRADES:"""
+
+BATCH_GRADE_PROMPT = PromptTemplate(input_variables=["items"], template=BATCH_GRADE_TEMPLATE)
+
+GRADE_LINE_RE = re.compile(r"ITEM\s*(\d+)\s*:\s*(CORRECT|INCORRECT)\b", re.IGNORECASE)
+
+# Tokens allowed for each "ITEM n: INCORRECT" reply line
+TOKENS_PER_GRADE = 8
+
+# More items than this per prompt and graders start to lose track
+DEFAULT_GRADE_BATCH_SIZE = 20
+
+def format_item(number, example, prediction):
+    return f"ITEM {number}\nQUESTION: {example['query']}\nSTUDENT ANSWER: {prediction['result']}\nTRUE ANSWER: {example['answer']}\n"
+
+def parse_grades(text, count):
+    """Verdicts by item number (1-based) from a batch reply; items missing or out of range are left out."""
+    grades = {}
+    for number, grade in GRADE_LINE_RE.findall(text):
+        if 1 <= int(number) <= count:
+            grades.setdefault(int(number), grade.upper())
+    return grades
+
+class BatchGrader:
+    """
+    Grades many predictions per LLM call instead of QAEvalChain's one call per example.
+
+    Items are packed in order into batches that fit the model's context window, with room
+    for one verdict line each, up to max_batch_size items (GRADE_BATCH_SIZE, default 20).
+    Batches run concurrently, each holding a limiter slot. Any item whose verdict can't be
+    parsed from its batch's reply is graded again on its own by QAEvalChain.
+    """
+
+    def __init__(self, llm, max_batch_size=None):
+        # langchain.chains is only loaded once there is something to grade
+        from langchain.chains import LLMChain
+        self.llm = llm
+        self.max_batch_size = max_batch_size or int(os.getenv("GRADE_BATCH_SIZE", DEFAULT_GRADE_BATCH_SIZE))
+        self.chain = LLMChain(llm=llm, prompt=BATCH_GRADE_PROMPT)
+
+    def batches(self, examples, predictions):
+        """Splits item indices into batches that fit the context window, in order."""
+        from modules.chains import context_window, model_name
+        model = model_name(self.llm) or None
+        budget = context_window(self.llm) - count_tokens(BATCH_GRADE_PROMPT.format(items=""), model)
+        batches, current, used = [], [], 0
+        for i, (example, prediction) in enumerate(zip(examples, predictions)):
+            size = count_tokens(format_item(len(current) + 1, example, prediction), model) + TOKENS_PER_GRADE
+            if current and (used + size > budget or len(current) == self.max_batch_size):
+                batches.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += size
+        if current:
+            batches.append(current)
+        return batches
+
+    def grade_batch(self, batch, examples, predictions, limiter):
+        items = "\n".join(format_item(n, examples[i], predictions[i]) for n, i in enumerate(batch, start=1))
+        handler = LatencyCallbackHandler()
+        with limiter:
+            reply = self.chain.predict(items=items, callbacks=[handler])
+        grades = parse_grades(reply, len(batch))
+        # Each item is charged an equal share of its batch's call
+        share = sum(span["time"] for span in handler.spans) / len(batch)
+        # The batch's calls go with its first graded item, so metrics count each call once
+        calls, first = handler.calls(), min(grades, default=None)
+        return {i: {"results": grades[n], "grade_time": share, "llm_calls": calls if n == first else []} for n, i in enumerate(batch, start=1) if n in grades}
+
+    def grade_individually(self, indices, examples, predictions, limiter):
+        # Only needed when batching is off or a batch reply can't be parsed
+        from langchain.evaluation.qa import QAEvalChain
+        handler = LatencyCallbackHandler()
+        with limiter:
+            outputs = QAEvalChain.from_llm(self.llm).evaluate(
+                [examples[i] for i in indices], [predictions[i] for i in indices], callbacks=[handler]
+            )
+        spans = handler.calls()
+        matched = len(spans) == len(indices)
+        return {
+            i: {"results": output["results"], "grade_time": spans[n]["time"] if matched else None,
+                "llm_calls": [spans[n]] if matched else spans if n == 0 else []}
+            for n, (i, output) in enumerate(zip(indices, outputs))
+        }
+
+    def grade(self, examples, predictions, limiter=None):
+        """
+        Grades every prediction against its example's reference answer.
+
+        Returns:
+        - A list in example order of dictionaries with 'results' (the verdict, as QAEvalChain
+          gives it), 'grade_time' (ms spent grading that item) and 'llm_calls' (the spans of
+          the grading calls; a batch's all go with its first graded item).
+        """
+        limiter = limiter or nullcontext()
+        if not examples:
+            return []
+        if self.max_batch_size <= 1:
+            graded = self.grade_individually(list(range(len(examples))), examples, predictions, limiter)
+            return [graded[i] for i in range(len(examples))]
+
+        batches = self.batches(examples, predictions)
+        graded = {}
+        with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+            for result in pool.map(profiled(lambda batch: self.grade_batch(batch, examples, predictions, limiter)), batches):
+                graded.update(result)
+
+        unparsed = [i for i in range(len(examples)) if i not in graded]
+        if unparsed:
+            print(f"Grading {len(unparsed)} of {len(examples)} items individually: no verdict in the batch reply")
+            graded.update(self.grade_individually(unparsed, examples, predictions, limiter))
+        return [graded[i] for i in range(len(examples))]
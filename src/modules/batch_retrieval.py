@@ -0,0 +1,58 @@
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from modules.numpy_store import NumpyVectorStore
+from modules.profiling import profile_phase
+
+def batch_retrieve(db, queries, k=4):
+    """
+    Retrieves the top-k documents for every query with one embedding call and one search.
+
+    Parameters:
+    - db: The vector db (NumpyVectorStore or Chroma; other stores search per query).
+    - queries: The query strings.
+    - k: Number of documents per query, as the retriever's default.
+
+    Returns:
+    - A list with the documents for each query, best match first.
+    """
+    if not queries:
+        return []
+    with profile_phase("retrieval"):
+        # One embedding request for all the queries
+        vectors = db.embeddings.embed_documents(list(queries))
+
+        if isinstance(db, NumpyVectorStore):
+            return db.batch_similarity_search_by_vector(vectors, k)
+
+        if hasattr(db, "_collection"):
+            # Chroma resolves every query embedding in a single query call
+            results = db._collection.query(query_embeddings=vectors, n_results=k, include=["documents", "metadatas"])
+            return [
+                [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+                for texts, metadatas in zip(results["documents"], results["metadatas"])
+            ]
+
+        return [db.similarity_search_by_vector(vector, k) for vector in vectors]
+
+class PrefetchedRetriever(BaseRetriever):
+    """
+    Retriever serving documents fetched ahead of time by batch_retrieve, so chains built
+    on it skip the per-query embedding and search. Unknown queries go to the fallback retriever.
+    """
+
+    documents: Dict[str, List[Document]]
+    fallback: Optional[BaseRetriever] = None
+
+    @classmethod
+    def from_queries(cls, db, queries, k=4):
+        queries = list(dict.fromkeys(queries))
+        return cls(documents=dict(zip(queries, batch_retrieve(db, queries, k))), fallback=db.as_retriever(search_kwargs={"k": k}))
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if query in self.documents:
+            return self.documents[query]
+        if self.fallback is None:
+            return []
+        with profile_phase("retrieval"):
+            return self.fallback.invoke(query, config={"callbacks": run_manager.get_child()})
@@ -0,0 +1,132 @@
+import os
+import io
+import csv
+import mmap
+from array import array
+from langchain_core.documents import Document
+
+# Index files start with the CSV's size and mtime, then hold one byte offset per row plus the end offset
+INDEX_HEADER = 2
+
+def row_index_filename_gen(file_path):
+    # e.g. data/OutdoorClothingCatalog_1000.rowidx
+    return os.path.splitext(file_path)[0] + ".rowidx"
+
+def record_to_document(header, values, file_path, row):
+    # Same page_content and metadata as LangChain's CSVLoader, so content hashes match;
+    # its DictReader fills the columns missing from a short row with None
+    values = list(values) + [None] * (len(header) - len(values))
+    content = "\n".join(f"{k.strip()}: {v.strip() if v is not None else v}" for k, v in zip(header, values))
+    return Document(page_content=content, metadata={"source": file_path, "row": row})
+
+def scan_record_offsets(data, start):
+    """
+    Yields the byte offset of every CSV record from start onwards, then the end offset.
+    A newline only ends a record when it is outside quotes, i.e. the record so far holds
+    an even number of quote characters.
+    """
+    size = len(data)
+    record_start, quotes, pos = start, 0, start
+    while pos < size:
+        newline = data.find(b"\n", pos)
+        line_end = size if newline == -1 else newline + 1
+        quotes += data[pos:line_end].count(b'"')
+        pos = line_end
+        if quotes % 2 == 0:
+            # Skip empty lines, which csv.reader reads as [] and CSVLoader's DictReader drops
+            if data[record_start:pos].strip(b"\r\n"):
+                yield record_start
+            record_start, quotes = pos, 0
+    yield size
+
+class CatalogReader:
+    """
+    Lazy reader for a catalog CSV, producing the same Documents as CSVLoader.
+
+    lazy_load() streams the rows as a generator. Indexing and slicing use a byte-offset
+    row index, built once and kept next to the CSV (.rowidx), that is memory-mapped
+    along with the CSV. Only the rows asked for are parsed, so memory stays flat
+    however large the catalog is.
+    """
+
+    def __init__(self, file_path, encoding="utf-8"):
+        self.file_path = file_path
+        self.encoding = encoding
+        self._data = None
+        self._offsets = None
+        self._header = None
+
+    def lazy_load(self):
+        with open(self.file_path, newline="", encoding=self.encoding) as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            # Rows are numbered as in the index, which leaves out empty lines
+            row = 0
+            for values in reader:
+                if not values:
+                    continue
+                yield record_to_document(header, values, self.file_path, row)
+                row += 1
+
+    def load(self):
+        return list(self.lazy_load())
+
+    def __iter__(self):
+        return self.lazy_load()
+
+    def __len__(self):
+        return len(self._row_offsets()) - 1
+
+    def __getitem__(self, key):
+        offsets = self._row_offsets()
+        if isinstance(key, slice):
+            return [self._read_row(row) for row in range(*key.indices(len(offsets) - 1))]
+        row = key + len(offsets) - 1 if key < 0 else key
+        if not 0 <= row < len(offsets) - 1:
+            raise IndexError(f"row {key} out of range for {self.file_path}")
+        return self._read_row(row)
+
+    def _read_row(self, row):
+        start, end = self._offsets[row], self._offsets[row + 1]
+        text = self._data[start:end].decode(self.encoding)
+        values = next(csv.reader(io.StringIO(text, newline="")), [])
+        return record_to_document(self._header, values, self.file_path, row)
+
+    def _row_offsets(self):
+        if self._offsets is not None:
+            return self._offsets
+
+        with open(self.file_path, "rb") as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.file_path) else b""
+
+        # Header row: everything up to the first record offset
+        offsets = self._load_or_build_index()
+        header_text = self._data[:offsets[0]].decode(self.encoding)
+        self._header = next(csv.reader(io.StringIO(header_text, newline="")), [])
+        self._offsets = offsets
+        return offsets
+
+    def _load_or_build_index(self):
+        stat = os.stat(self.file_path)
+        index_path = row_index_filename_gen(self.file_path)
+
+        if os.path.exists(index_path) and os.path.getsize(index_path) >= 8 * (INDEX_HEADER + 1):
+            with open(index_path, "rb") as file:
+                index = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)).cast("Q")
+            if index[0] == stat.st_size and index[1] == stat.st_mtime_ns:
+                return index[INDEX_HEADER:]
+
+        # Build the index: skip the header record, then record every row's start offset
+        records = scan_record_offsets(self._data, 0)
+        next(records, None)
+        offsets = array("Q", [stat.st_size, stat.st_mtime_ns])
+        offsets.extend(records)
+        if len(offsets) == INDEX_HEADER:
+            # Empty file: no header and no rows
+            offsets.append(0)
+
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            offsets.tofile(file)
+        os.replace(tmp_path, index_path)
+        return memoryview(offsets)[INDEX_HEADER:]
@@ -0,0 +1,165 @@
+import os
+from typing import Any
+from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
+from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
+from langchain.chains.combine_documents.refine import RefineDocumentsChain
+from langchain_core.documents import Document
+from langchain_core.prompts import format_document
+from modules.concurrent_map import enable_concurrent_map, enable_early_exit
+from modules.gated_refine import enable_relevance_gate
+from modules.tokens import count_tokens
+
+# Context window (tokens) per model; unknown models get the smallest
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-0301": 4096,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Tokens kept free for the answer when the model sets no max_tokens
+DEFAULT_ANSWER_TOKENS = 256
+
+def model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+
+def context_window(llm):
+    return CONTEXT_WINDOWS.get(model_name(llm), DEFAULT_CONTEXT_WINDOW)
+
+def answer_tokens(llm):
+    return getattr(llm, "max_tokens", None) or DEFAULT_ANSWER_TOKENS
+
+class AutoCombineDocumentsChain(BaseCombineDocumentsChain):
+    """
+    Picks the combine strategy per question: the retrieved documents are stuffed into one
+    prompt when that prompt plus the expected answer fits the model's context window,
+    and only otherwise handed to the fallback chain (map_reduce or map_rerank).
+    """
+
+    stuff_chain: BaseCombineDocumentsChain
+    fallback_chain: BaseCombineDocumentsChain
+    max_context_tokens: int
+    answer_tokens: int = DEFAULT_ANSWER_TOKENS
+
+    @property
+    def _chain_type(self):
+        return "auto_combine_docs"
+
+    def stuff_prompt_tokens(self, docs, **kwargs):
+        # Render the exact prompt stuff would send and count it
+        inputs = self.stuff_chain._get_inputs(docs, **kwargs)
+        llm_chain = self.stuff_chain.llm_chain
+        return count_tokens(llm_chain.prompt.format(**inputs), model_name(llm_chain.llm) or None)
+
+    def select_chain(self, docs, **kwargs):
+        fits = self.stuff_prompt_tokens(docs, **kwargs) + self.answer_tokens <= self.max_context_tokens
+        return self.stuff_chain if fits else self.fallback_chain
+
+    def combine_docs(self, docs, callbacks=None, **kwargs: Any):
+        return self.select_chain(docs, **kwargs).combine_docs(docs, callbacks=callbacks, **kwargs)
+
+    async def acombine_docs(self, docs, callbacks=None, **kwargs: Any):
+        return await self.select_chain(docs, **kwargs).acombine_docs(docs, callbacks=callbacks, **kwargs)
+
+def pack_documents(sizes, capacity):
+    """
+    First-fit-decreasing bin packing: groups item indices into as few bins of the given
+    capacity as it can, taking the largest items first. An item larger than the capacity
+    gets a bin of its own. Indices within a bin, and the bins by their first index,
+    keep the original order.
+    """
+    bins, free = [], []
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        for b, room in enumerate(free):
+            if sizes[i] <= room:
+                bins[b].append(i)
+                free[b] -= sizes[i]
+                break
+        else:
+            bins.append([i])
+            free.append(capacity - sizes[i])
+    return sorted(sorted(b) for b in bins)
+
+class PackedRefineDocumentsChain(RefineDocumentsChain):
+    """
+    Hybrid of stuff and refine: the retrieved documents are packed into as few
+    context-window-sized batches as possible (first-fit-decreasing on token counts),
+    each batch is stuffed into one prompt, and the answer is refined across batches
+    rather than across single documents. For large k that is a handful of calls instead of k.
+    """
+
+    max_context_tokens: int
+    answer_tokens: int = DEFAULT_ANSWER_TOKENS
+    document_separator: str = "\n\n"
+
+    def batch_capacity(self, **kwargs):
+        # What the refine prompt leaves for documents, with an answer-sized existing answer
+        llm_chain = self.refine_llm_chain
+        inputs = {**kwargs, self.document_variable_name: "", self.initial_response_name: " ".join(["answer"] * self.answer_tokens)}
+        overhead = count_tokens(llm_chain.prompt.format(**inputs), model_name(llm_chain.llm) or None)
+        return self.max_context_tokens - overhead - self.answer_tokens
+
+    def pack(self, docs, **kwargs):
+        """The documents merged into batches, one Document per LLM call."""
+        if not docs:
+            return docs
+        model = model_name(self.refine_llm_chain.llm) or None
+        texts = [format_document(doc, self.document_prompt) for doc in docs]
+        sizes = [count_tokens(text + self.document_separator, model) for text in texts]
+        return [
+            Document(page_content=self.document_separator.join(texts[i] for i in batch), metadata=docs[batch[0]].metadata)
+            for batch in pack_documents(sizes, self.batch_capacity(**kwargs))
+        ]
+
+    def combine_docs(self, docs, callbacks=None, **kwargs: Any):
+        return super().combine_docs(self.pack(docs, **kwargs), callbacks=callbacks, **kwargs)
+
+    async def acombine_docs(self, docs, callbacks=None, **kwargs: Any):
+        return await super().acombine_docs(self.pack(docs, **kwargs), callbacks=callbacks, **kwargs)
+
+def build_combine_chain(llm, chain_type, verbose=None, limiter=None):
+    """
+    Builds the combine-documents chain for a chain type: LangChain's "stuff", "map_reduce",
+    "refine" and "map_rerank", "auto" (stuff when it fits, else AUTO_FALLBACK, default map_reduce),
+    "packed_refine" (refine across context-sized batches of documents), "gated_refine"
+    (refine over only the documents relevant to the question, stopping once the answer settles)
+    or "early_exit_map_rerank" (map_rerank that stops calling once an answer scores high enough).
+    limiter is the global concurrency limiter, a slot of which the caller holds while the
+    chain runs; concurrent map calls take further slots of it.
+    """
+    if chain_type == "auto":
+        fallback = os.getenv("AUTO_FALLBACK", "map_reduce")
+        return AutoCombineDocumentsChain(
+            stuff_chain=load_qa_chain(llm, chain_type="stuff", verbose=verbose),
+            fallback_chain=build_combine_chain(llm, fallback, verbose, limiter),
+            max_context_tokens=context_window(llm),
+            answer_tokens=answer_tokens(llm),
+            verbose=verbose,
+        )
+
+    if chain_type == "packed_refine":
+        refine = load_qa_chain(llm, chain_type="refine", verbose=verbose)
+        fields = {name: getattr(refine, name) for name in RefineDocumentsChain.__fields__ if name != "callback_manager"}
+        return PackedRefineDocumentsChain(**fields, max_context_tokens=context_window(llm), answer_tokens=answer_tokens(llm))
+
+    if chain_type == "gated_refine":
+        return enable_relevance_gate(load_qa_chain(llm, chain_type="refine", verbose=verbose))
+
+    if chain_type == "early_exit_map_rerank":
+        map_rerank = enable_concurrent_map(load_qa_chain(llm, chain_type="map_rerank", verbose=verbose), limiter=limiter)
+        return enable_early_exit(map_rerank, limiter=limiter)
+
+    # map_reduce and map_rerank send their per-document calls concurrently, within the rate limits
+    return enable_concurrent_map(load_qa_chain(llm, chain_type=chain_type, verbose=verbose), limiter=limiter)
+
+def build_qa(llm, chain_type, retriever, verbose=True, limiter=None):
+    """Builds the RetrievalQA chain for any supported chain type, within the global limiter if given."""
+    return RetrievalQA(
+        combine_documents_chain=build_combine_chain(llm, chain_type, limiter=limiter),
+        retriever=retriever,
+        verbose=verbose,
+    )
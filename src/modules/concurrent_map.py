@@ -0,0 +1,152 @@
+import os
+from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from langchain.chains import LLMChain
+from langchain.chains.combine_documents.map_reduce import MapReduceDocumentsChain
+from langchain.chains.combine_documents.map_rerank import MapRerankDocumentsChain
+from langchain_core.outputs import LLMResult
+from modules.profiling import profiled
+
+# map_rerank stops issuing calls once an answer scores at least this (out of 100)
+DEFAULT_RERANK_EXIT_SCORE = 90
+
+def reserve_slots(limiter, wanted):
+    """
+    Takes up to wanted more slots of the global concurrency limiter without waiting for any,
+    and returns how many it got. The chain's caller already holds one slot for the chain run,
+    so waiting for more could deadlock once every slot is held by a chain doing the same.
+    Without a limiter nothing caps the calls, so all of them are granted.
+    """
+    if limiter is None:
+        return wanted
+    taken = 0
+    while taken < wanted and limiter.acquire(False):
+        taken += 1
+    return taken
+
+def release_slots(limiter, taken):
+    if limiter is None:
+        return
+    for _ in range(taken):
+        limiter.release()
+
+class ConcurrentLLMChain(LLMChain):
+    """
+    LLMChain whose batch of prompts (e.g. the map step) is sent as concurrent single calls,
+    up to max_workers at a time (the model charges each to the shared rate limiter, see backend.get_llm).
+    Calls beyond the first also need a free slot of the global limiter (MAX_CONCURRENCY),
+    so the chains together never have more calls in flight than it allows.
+    """
+
+    max_workers: int = 4
+    limiter: Optional[Any] = None
+
+    def generate(self, input_list, run_manager=None):
+        prompts, stop = self.prep_prompts(input_list, run_manager=run_manager)
+        callbacks = run_manager.get_child() if run_manager else None
+
+        def call(prompt):
+            return self.llm.generate_prompt([prompt], stop, callbacks=callbacks, **self.llm_kwargs)
+
+        extra = reserve_slots(self.limiter, max(min(self.max_workers, len(prompts)), 1) - 1)
+        try:
+            with ThreadPoolExecutor(max_workers=1 + extra) as pool:
+                results = list(pool.map(profiled(call), prompts))
+        finally:
+            release_slots(self.limiter, extra)
+
+        # Merge back into one result, summing the token usage of the calls
+        token_usage = {}
+        for result in results:
+            for key, value in (result.llm_output or {}).get("token_usage", {}).items():
+                token_usage[key] = token_usage.get(key, 0) + value
+        llm_output = {**(results[0].llm_output or {}), "token_usage": token_usage} if results else None
+        return LLMResult(generations=[g for result in results for g in result.generations], llm_output=llm_output)
+
+class EarlyExitMapRerankDocumentsChain(MapRerankDocumentsChain):
+    """
+    map_rerank that stops paying for documents once a confident answer is in.
+
+    The per-document calls are issued in retrieval order (most similar first), at most
+    max_workers at a time, and as many as the global limiter has free slots for. As soon
+    as an answer scores at least exit_score no further calls are issued; the calls already
+    in flight are paid for, so they finish and are ranked with the rest.
+    """
+
+    max_workers: int = 2
+    exit_score: int = DEFAULT_RERANK_EXIT_SCORE
+    limiter: Optional[Any] = None
+
+    def parse_call(self, doc, callbacks=None, **kwargs):
+        output = self.llm_chain.predict(callbacks=callbacks, **{self.document_variable_name: doc.page_content}, **kwargs)
+        return self.llm_chain.prompt.output_parser.parse(output)
+
+    def combine_docs(self, docs, callbacks=None, **kwargs: Any):
+        results = {}
+        parse_call = profiled(self.parse_call)
+        extra = reserve_slots(self.limiter, max(min(self.max_workers, len(docs)), 1) - 1)
+        try:
+            self.rank(docs, parse_call, 1 + extra, results, callbacks, **kwargs)
+        finally:
+            release_slots(self.limiter, extra)
+
+        order = sorted(results)
+        return self._process_results([docs[i] for i in order], [results[i] for i in order])
+
+    def rank(self, docs, parse_call, max_workers, results, callbacks=None, **kwargs):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            remaining = iter(enumerate(docs))
+            pending = {}
+            confident = False
+            while True:
+                # Keep max_workers calls in flight until a confident answer arrives
+                while not confident and len(pending) < max_workers:
+                    i, doc = next(remaining, (None, None))
+                    if doc is None:
+                        break
+                    pending[pool.submit(parse_call, doc, callbacks, **kwargs)] = i
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    results[pending.pop(future)] = result
+                    confident = confident or int(result[self.rank_key]) >= self.exit_score
+
+def enable_concurrent_map(combine_chain, max_workers=None, limiter=None):
+    """
+    Switches the map step of a map_reduce or map_rerank combine-documents chain to concurrent calls.
+    max_workers defaults to MAP_CONCURRENCY (4); limiter is the global concurrency limiter whose
+    slots the extra calls take.
+    Other chain types are returned unchanged.
+    """
+    if not isinstance(combine_chain, (MapReduceDocumentsChain, MapRerankDocumentsChain)):
+        return combine_chain
+
+    max_workers = max_workers or int(os.getenv("MAP_CONCURRENCY", 4))
+    map_chain = combine_chain.llm_chain
+    fields = {name: getattr(map_chain, name) for name in LLMChain.__fields__ if name != "callback_manager"}
+    combine_chain.llm_chain = ConcurrentLLMChain(
+        **fields,
+        max_workers=max_workers,
+        limiter=limiter,
+    )
+    return combine_chain
+
+def enable_early_exit(combine_chain, max_workers=None, exit_score=None, limiter=None):
+    """
+    Switches a map_rerank combine-documents chain to EarlyExitMapRerankDocumentsChain, for the
+    "early_exit_map_rerank" chain type. max_workers defaults to RERANK_CONCURRENCY (2) calls in flight
+    and exit_score to RERANK_EXIT_SCORE (90; above 100 scores every document).
+    Other chain types are returned unchanged.
+    """
+    if not isinstance(combine_chain, MapRerankDocumentsChain):
+        return combine_chain
+
+    fields = {name: getattr(combine_chain, name) for name in MapRerankDocumentsChain.__fields__ if name != "callback_manager"}
+    return EarlyExitMapRerankDocumentsChain(
+        **fields,
+        max_workers=max_workers or int(os.getenv("RERANK_CONCURRENCY", 2)),
+        exit_score=exit_score if exit_score is not None else int(os.getenv("RERANK_EXIT_SCORE", DEFAULT_RERANK_EXIT_SCORE)),
+        limiter=limiter,
+    )
@@ -0,0 +1,161 @@
+import os
+import math
+from langchain_core.documents import Document
+from langchain.chains.combine_documents.stuff import StuffDocumentsChain
+from langchain.chains.combine_documents.map_reduce import MapReduceDocumentsChain
+from langchain.chains.combine_documents.map_rerank import MapRerankDocumentsChain
+from langchain.chains.combine_documents.refine import RefineDocumentsChain
+from langchain_core.prompts import format_document
+from modules.gated_refine import GatedRefineDocumentsChain
+from modules.chains import AutoCombineDocumentsChain, PackedRefineDocumentsChain, build_combine_chain, model_name
+from modules.backend import backend_name
+from modules.latency_model import LatencyModel, default_latency
+from modules.tokens import count_tokens
+
+# USD per 1K (prompt, completion) tokens
+MODEL_COSTS = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-0301": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+}
+
+# Chain types an over-budget question can be rerouted to
+REROUTE_CHAIN_TYPES = ["stuff", "map_reduce", "refine", "map_rerank", "packed_refine", "gated_refine"]
+
+# Tokens assumed for each model output (answers, map summaries, refine steps) before it exists
+EXPECTED_COMPLETION_TOKENS = 64
+
+# Rough gpt-3.5-turbo round-trip figures; calibrate against the measured llm_calls spans
+DEFAULT_LATENCY = LatencyModel(overhead_ms=400, ms_per_prompt_token=0.05, ms_per_completion_token=12)
+
+def placeholder(tokens):
+    # Stand-in text for a model output that hasn't been generated yet
+    return " ".join(["answer"] * tokens)
+
+def render_prompts(combine_chain, docs, question, completion_tokens=EXPECTED_COMPLETION_TOKENS):
+    """
+    Renders the prompts a combine-documents chain would send for these documents, grouped in
+    rounds: calls within a round can run in parallel, rounds run one after another.
+    Outputs the chain feeds back into later prompts are stood in for by placeholders.
+    """
+    if isinstance(combine_chain, AutoCombineDocumentsChain):
+        return render_prompts(combine_chain.select_chain(docs, question=question), docs, question, completion_tokens)
+
+    if isinstance(combine_chain, StuffDocumentsChain):
+        inputs = combine_chain._get_inputs(docs, question=question)
+        return [[combine_chain.llm_chain.prompt.format(**inputs)]]
+
+    if isinstance(combine_chain, MapRerankDocumentsChain):
+        prompt = combine_chain.llm_chain.prompt
+        return [[prompt.format(**{combine_chain.document_variable_name: d.page_content, "question": question}) for d in docs]]
+
+    if isinstance(combine_chain, MapReduceDocumentsChain):
+        prompt = combine_chain.llm_chain.prompt
+        map_round = [prompt.format(**{combine_chain.document_variable_name: d.page_content, "question": question}) for d in docs]
+        summaries = [Document(page_content=placeholder(completion_tokens), metadata=d.metadata) for d in docs]
+        reduce_chain = combine_chain.reduce_documents_chain.combine_documents_chain
+        return [map_round] + render_prompts(reduce_chain, summaries, question, completion_tokens)
+
+    if isinstance(combine_chain, RefineDocumentsChain):
+        if isinstance(combine_chain, GatedRefineDocumentsChain):
+            # Upper bound: the documents that pass the relevance gate, without stopping early
+            docs = combine_chain.select_docs(docs, question=question)
+        if isinstance(combine_chain, PackedRefineDocumentsChain):
+            docs = combine_chain.pack(docs, question=question)
+        if not docs:
+            return []
+        initial = combine_chain._construct_initial_inputs(docs, question=question)
+        rounds = [[combine_chain.initial_llm_chain.prompt.format(**initial)]]
+        for doc in docs[1:]:
+            inputs = {
+                combine_chain.document_variable_name: format_document(doc, combine_chain.document_prompt),
+                combine_chain.initial_response_name: placeholder(completion_tokens),
+                "question": question,
+            }
+            rounds.append([combine_chain.refine_llm_chain.prompt.format(**inputs)])
+        return rounds
+
+    raise ValueError(f"Can't estimate chain {type(combine_chain).__name__}")
+
+def estimate_strategy(combine_chain, docs, question, completion_tokens=EXPECTED_COMPLETION_TOKENS, latency=None, map_workers=None):
+    """
+    Predicts the LLM calls, tokens, cost and latency of answering a question with a
+    combine-documents chain, without calling the model.
+
+    Parameters:
+    - combine_chain: The chain, e.g. qa.combine_documents_chain or build_combine_chain(llm, chain_type).
+    - docs: The retrieved documents.
+    - question: The question being answered.
+    - completion_tokens: Expected length of each model output.
+    - latency: LatencyModel giving per-call latency (if None, the fake backend's own or DEFAULT_LATENCY).
+    - map_workers: Calls of one round that run at once (default MAP_CONCURRENCY, 4).
+
+    Returns:
+    - A dictionary with 'calls', 'prompt_tokens', 'completion_tokens', 'total_tokens',
+      'cost' (USD, None for unknown models) and 'latency' (ms).
+    """
+    latency = latency or (default_latency if backend_name() == "fake" else DEFAULT_LATENCY)
+    map_workers = map_workers or int(os.getenv("MAP_CONCURRENCY", 4))
+    model = model_name(combine_chain_llm(combine_chain)) or None
+    rounds = render_prompts(combine_chain, docs, question, completion_tokens)
+
+    prompt_tokens = [[count_tokens(prompt, model) for prompt in round] for round in rounds]
+    calls = sum(len(round) for round in rounds)
+    total_prompt = sum(sum(round) for round in prompt_tokens)
+    total_completion = calls * completion_tokens
+
+    # Each round takes as long as its slowest call times the waves needed to get through it
+    predicted_ms = 0.0
+    for round in prompt_tokens:
+        slowest = max(latency.time_to_first_token(t) + latency.generation_time(completion_tokens) for t in round)
+        predicted_ms += slowest * 10**3 * math.ceil(len(round) / map_workers)
+
+    costs = MODEL_COSTS.get(model)
+    cost = (total_prompt * costs[0] + total_completion * costs[1]) / 1000 if costs else None
+
+    return {
+        "calls": calls,
+        "prompt_tokens": total_prompt,
+        "completion_tokens": total_completion,
+        "total_tokens": total_prompt + total_completion,
+        "cost": cost,
+        "latency": predicted_ms,
+    }
+
+def combine_chain_llm(combine_chain):
+    # The model behind a combine-documents chain, for token counting and pricing
+    if isinstance(combine_chain, AutoCombineDocumentsChain):
+        return combine_chain_llm(combine_chain.stuff_chain)
+    chain = getattr(combine_chain, "llm_chain", None) or getattr(combine_chain, "initial_llm_chain", None)
+    return chain.llm if chain is not None else None
+
+def estimate_all(llm, chain_types, docs, question, **kwargs):
+    """Estimates every chain type for the same question and documents, keyed by chain type."""
+    return {chain_type: estimate_strategy(build_combine_chain(llm, chain_type), docs, question, **kwargs) for chain_type in chain_types}
+
+def within_budget(estimate, max_tokens=None, max_cost=None, max_latency=None):
+    """Whether an estimate stays within every budget given (tokens, USD, ms)."""
+    return ((max_tokens is None or estimate["total_tokens"] <= max_tokens)
+            and (max_cost is None or estimate["cost"] is None or estimate["cost"] <= max_cost)
+            and (max_latency is None or estimate["latency"] <= max_latency))
+
+def choose_strategy(estimates, **budget):
+    """
+    Reroutes a request: the fastest chain type whose estimate is within budget,
+    or None to reject it up front.
+    """
+    affordable = [(estimate["latency"], chain_type) for chain_type, estimate in estimates.items() if within_budget(estimate, **budget)]
+    return min(affordable)[1] if affordable else None
+
+def budget_from_env():
+    """
+    Per-question budget from QUERY_MAX_TOKENS, QUERY_MAX_COST (USD) and QUERY_MAX_LATENCY_MS,
+    as keyword arguments for within_budget. Empty when none are set.
+    """
+    budget = {}
+    for name, key, cast in [("QUERY_MAX_TOKENS", "max_tokens", int), ("QUERY_MAX_COST", "max_cost", float), ("QUERY_MAX_LATENCY_MS", "max_latency", float)]:
+        if os.getenv(name):
+            budget[key] = cast(os.getenv(name))
+    return budget
@@ -1,35 +1,25 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-import numpy as np
-import matplotlib.colors as mcolors
+import os
 
-# Assuming results_data is your list of ResultsData objects
+def pyplot():
+    """Imports pyplot on first use, on the headless Agg backend unless MPLBACKEND picks another."""
+    import matplotlib
+    if not os.getenv("MPLBACKEND"):
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
 
 def data_viz(results_data):
-    # Convert results_data into a DataFrame
-    data = {
-        "chain_type": [],
-        "eval_time": [],
-        "tokens_used": [],
-        "is_correct": []
-    }
-
-    for result in results_data:
-        for eval in result.eval:
-            data["chain_type"].append(result.chain_type)
-            data["eval_time"].append(eval["time"])
-            data["tokens_used"].append(eval["tokens_used"])
-            # 1 for correct, 0 otherwise
-            data["is_correct"].append(1 if eval["result"] == "CORRECT" else 0)
-
-    df = pd.DataFrame(data)
-
-    # Calculate averages and correctness ratio
-    agg_data = df.groupby('chain_type').agg({
-        'eval_time': 'mean',
-        'tokens_used': 'mean',
-        'is_correct': lambda x: np.mean(x) * 100  # correctness percentage
-    }).reset_index()
+    import numpy as np
+    import matplotlib.colors as mcolors
+    plt = pyplot()
+
+    # Averages and correctness ratio per chain type, straight from the columnar results store.
+    # A strategy whose every question was rejected over budget has no time or tokens: no bar
+    agg_data = results_data.summary()
+    untimed = agg_data['eval_time'].isna().to_numpy()
+    agg_data = agg_data.assign(eval_time=agg_data['eval_time'].astype(float).fillna(0.0), tokens_used=agg_data['tokens_used'].astype(float).fillna(0.0))
+    latency = results_data.latency_summary()
+    latency = latency.astype({column: float for column in ('mean', 'ci_low', 'ci_high', 'p90', 'p99') if column in latency})
 
     # Create a grouped bar chart with an additional bar for correct answers
     fig, ax = plt.subplots(figsize=(12, 8))
@@ -46,9 +36,20 @@ def data_viz(results_data):
     for idx, row in agg_data.iterrows():
         ax.bar(idx - bar_width/2, row['eval_time'], bar_width, color=sm.to_rgba(row['is_correct']))
 
+    # Bootstrap CI of the mean eval time, and the tail percentiles across trials
+    if 'ci_low' in latency:
+        ax.errorbar(positions - bar_width/2, latency['mean'], yerr=[latency['mean'] - latency['ci_low'], latency['ci_high'] - latency['mean']],
+                    fmt='none', ecolor='black', capsize=4, label='95% CI (mean time)')
+        ax.scatter(positions - bar_width/2, latency['p90'], marker='_', s=200, color='dimgray', zorder=3, label='P90 time')
+        ax.scatter(positions - bar_width/2, latency['p99'], marker='v', color='black', zorder=3, label='P99 time')
+        ax.legend(loc='upper left')
+
     # Tokens Used bars
     ax.bar(positions + bar_width/2, agg_data['tokens_used'], bar_width, color='lightblue')
 
+    for position in positions[untimed]:
+        ax.annotate('all rejected', (position, 0), ha='center', va='bottom', color='dimgray')
+
     # Correctness adjustment: create a dummy imshow for the colorbar reference
     cb_ax = fig.add_axes([0, 0, 0.1, 0.1], visible=False)
     cb_im = cb_ax.imshow([[0, 100]], cmap="RdYlGn")
@@ -66,3 +67,34 @@ def data_viz(results_data):
     plt.tight_layout()
 
     plt.savefig("../results/data_viz.png")
+
+
+def scaling_curves(rows, param, baseline, path):
+    """
+    Plots latency, tokens and throughput against one swept benchmark parameter,
+    one line per chain type, from the rows where every other parameter is at its baseline.
+    """
+    import pandas as pd
+    plt = pyplot()
+
+    df = pd.DataFrame(rows)
+    others = [p for p in baseline if p != param]
+    df = df[(df[others] == pd.Series({p: baseline[p] for p in others})).all(axis=1)].sort_values(param)
+
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    for chain_type, group in df.groupby('chain_type'):
+        axes[0].plot(group[param], group['mean_ms'], marker='o', label=chain_type)
+        axes[1].plot(group[param], group['mean_tokens'], marker='o', label=chain_type)
+        axes[2].plot(group[param], group['throughput_qps'], marker='o', label=chain_type)
+
+    for ax, label in zip(axes, ['Mean Latency (ms)', 'Mean Tokens per Query', 'Throughput (queries/s)']):
+        ax.set_xlabel(param)
+        ax.set_ylabel(label)
+        if param == 'rows':
+            ax.set_xscale('log')
+        ax.legend()
+    fig.suptitle(f'Scaling with {param} (others at baseline)')
+    plt.tight_layout()
+
+    plt.savefig(path)
+    plt.close(fig)
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+_lock = threading.Lock()
+
+def file_hash(file_path):
+    # Content hash of the source CSV, read in chunks so large catalogs stay cheap
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def eval_set_filename_gen(file_path, generator_model):
+    # e.g. data/OutdoorClothingCatalog_1000.gpt-3.5-turbo.evalset.json
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.dirname(file_path), f"{base_name}.{generator_model}.evalset.json")
+
+def load_eval_set(store_path):
+    if not os.path.exists(store_path):
+        return {"version": 0, "csv_hash": None, "rows": {}}
+    with open(store_path, encoding="utf-8") as file:
+        return json.load(file)
+
+def save_eval_set(store_path, eval_set):
+    # Write to a temp file and swap it in, so a crash never leaves a half-written store
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(eval_set, file, indent=2)
+    os.replace(tmp_path, store_path)
+
+def get_or_generate_examples(file_path, documents, generator_model, generate):
+    """
+    Returns the evaluation Q&As for the given documents, generating only what the store lacks.
+
+    Parameters:
+    - file_path: The source CSV, whose content hash versions the store.
+    - documents: The catalog rows (Documents) to build examples from, e.g. the first five.
+    - generator_model: Name of the model generating the examples; each model has its own store.
+    - generate: Callable turning a list of Documents into a list of {'query', 'answer'} dicts.
+
+    Returns:
+    - A list of dictionaries with 'query' and 'answer' fields, one per document.
+      When the CSV is unchanged the stored examples are returned without hashing any rows;
+      otherwise only rows whose content changed (or are new) are regenerated.
+    """
+    store_path = eval_set_filename_gen(file_path, generator_model)
+    csv_hash = file_hash(file_path)
+
+    with _lock:
+        eval_set = load_eval_set(store_path)
+        rows = eval_set["rows"]
+        keys = [str(doc.metadata.get("row", i)) for i, doc in enumerate(documents)]
+
+        if eval_set["csv_hash"] == csv_hash and all(key in rows for key in keys):
+            print(f"Using evaluation set v{eval_set['version']} from {store_path}")
+            return [rows[key]["example"] for key in keys]
+
+        # Regenerate only the rows that are new or whose content changed
+        hashes = [text_hash(doc.page_content) for doc in documents]
+        stale = [i for i, key in enumerate(keys) if rows.get(key, {}).get("hash") != hashes[i]]
+        if stale:
+            print(f"Generating {len(stale)} of {len(documents)} evaluation examples")
+            for i, example in zip(stale, generate([documents[i] for i in stale])):
+                rows[keys[i]] = {"hash": hashes[i], "example": example}
+            eval_set["version"] += 1
+
+        eval_set.update(csv_hash=csv_hash, generator_model=generator_model, updated=datetime.now().isoformat())
+        save_eval_set(store_path, eval_set)
+        print(f"Saved evaluation set v{eval_set['version']} to {store_path}")
+
+        return [rows[key]["example"] for key in keys]
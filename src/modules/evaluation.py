@@ -1,13 +1,13 @@
-from langchain.evaluation.qa import QAGenerateChain
-from langchain.evaluation.qa import QAEvalChain
-from langchain.indexes.vectorstore import VectorStoreIndexWrapper
-from langchain.chains import RetrievalQA
-from langchain_community.document_loaders import CSVLoader
-from modules.set_model import llm_model
-from langchain_openai import ChatOpenAI
-from modules.results_data import ResultsData
-from datetime import datetime
-from langchain.callbacks import get_openai_callback
+import os
+from modules.eval_set_store import get_or_generate_examples
+from time import perf_counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from modules.metrics import observe_prediction, observe_grade, observe_retrieval
+from modules.profiling import profile_phase
+
+# The chain, grading and model modules (LangChain, NumPy) are imported where they are used,
+# so a sharded worker starts without loading them for the parent's bookkeeping
 
 def langchain_output_parser(qa_output):
     """
@@ -32,95 +32,284 @@ def langchain_output_parser(qa_output):
     return parsed_output
 
 
-def generate_qas(file_path, db, llm, chain_type):
-    # Load vector db to index
-    loader = CSVLoader(file_path=file_path)
-    data = loader.load()
-    index = VectorStoreIndexWrapper(vectorstore=db)
+def generate_examples(file_path, limiter=None, num_examples=5):
+    """
+    Returns the LLM-generated evaluation Q&As for the first num_examples catalog rows.
+    They are generated once and kept in the evaluation-set store, so every strategy is
+    graded on the same questions and only changed rows are ever regenerated.
+    """
+    # Shared concurrency limit, if running alongside other strategies
+    limiter = limiter or nullcontext()
+
+    from modules.backend import get_llm
+    from modules.catalog import CatalogReader
+
+    # Only the rows used are parsed, not the whole catalog
+    with profile_phase("csv_load"):
+        data = CatalogReader(file_path)[:num_examples]
+
+    # LLM-Generated example Q&A pairs; the langchain.evaluation stack is only loaded to generate them
+    from langchain.evaluation.qa import QAGenerateChain
+    generator_llm = get_llm(temperature=0.7)
+    example_gen_chain = QAGenerateChain.from_llm(generator_llm)
+
+    def generate(documents):
+        # the warning below can be safely ignored
+        with limiter:
+            raw_examples = example_gen_chain.apply( # create raw examples
+                [{"doc": t} for t in documents],
+            )
+        # Parse the raw examples into required format
+        return langchain_output_parser(raw_examples)
+
+    return get_or_generate_examples(file_path, data, generator_llm.model_name, generate)
+
+def generate_qas(file_path, db, llm, chain_type, limiter=None, examples=None, retriever=None, journal=None, trials=1, warm_up=True):
+    from modules.chains import build_qa
+
+    # Retrieve from the vector db, unless documents were already retrieved in a batch
+    retriever = retriever or db.as_retriever()
 
-    qa = RetrievalQA.from_chain_type(
-        llm=llm, 
-        chain_type=chain_type, 
-        retriever=index.vectorstore.as_retriever(), 
-        verbose=True,
-        # chain_type_kwargs = {
-        #     "document_separator": "<<<<>>>>>"
-        # }
-    ) 
+    # Any LangChain chain type, or "auto" to pick one per question from the retrieved token budget
+    qa = build_qa(llm, chain_type, retriever, verbose=True, limiter=limiter)
 
-    # LLM-Generated example Q&A pairs 
-    example_gen_chain = QAGenerateChain.from_llm(ChatOpenAI(model=llm_model()))
-    # the warning below can be safely ignored
-    raw_examples = example_gen_chain.apply( # create raw examples
-        [{"doc": t} for t in data[:5]],
-    )
+    # Shared concurrency limit, if running alongside other strategies
+    limiter = limiter or nullcontext()
 
-    # Parse the raw examples into required format
-    examples = langchain_output_parser(raw_examples)
+    # Evaluation Q&As, shared across strategies
+    if examples is None:
+        examples = generate_examples(file_path, limiter)
 
-    # run for manual evaluation
-    qa.run(examples[0]["query"])
+    # run for manual evaluation, unless a resumed run already has this strategy's results
+    if warm_up and (journal is None or not journal.is_complete(chain_type, examples, trials)):
+        with limiter, profile_phase("chain"):
+            qa.run(examples[0]["query"])
 
     return qa, examples
 
-def evaluate(chain_type, qa, examples, llm, results_data):
-    # LLM assisted evaluation
+def preflight(chain_type, qa, examples, llm, limiter=None):
+    """
+    Estimates the calls, tokens, cost and latency of every example before any model call,
+    from the prompts the chain would render for its retrieved documents.
+    With a per-question budget set (see cost_estimator.budget_from_env), over-budget examples
+    are rerouted to the fastest chain type that fits (OVER_BUDGET=reroute, the default)
+    or rejected (OVER_BUDGET=reject, or when nothing fits).
 
-    # Measure number of tokens used
-    #TODO: remove duplication
-    with get_openai_callback() as cb:
-        start = datetime.now()
+    The documents retrieved for the estimates are served to the chains (through a
+    PrefetchedRetriever), so no question is embedded and searched twice.
 
-        try:
-            predictions = qa.apply(examples)
-        except ValueError as e: 
-            response = e
+    Returns:
+    - The estimates, each with the 'chain_type' it was made for, and the chain to run
+      per example (None when rejected).
+    """
+    from langchain.chains import RetrievalQA
+    from modules.batch_retrieval import PrefetchedRetriever
+    from modules.chains import build_qa
+    from modules.cost_estimator import estimate_strategy, estimate_all, choose_strategy, within_budget, budget_from_env, REROUTE_CHAIN_TYPES
+    from modules.instrumentation import to_ms
 
-        end = datetime.now()
-        
-    # Calculate the difference between the end and start timestamps to get the execution duration.
-    # The duration is converted to milliseconds for a more precise and readable format.
-    td = (end - start).total_seconds() * 10**3
-    tokens_used = cb.total_tokens
+    budget = budget_from_env()
+    reroute = os.getenv("OVER_BUDGET", "reroute") == "reroute"
+    rerouted_chains = {}
+    estimates, routes = [], []
+
+    queries = list(dict.fromkeys(example["query"] for example in examples))
+    retriever = qa.retriever
+    if not (isinstance(retriever, PrefetchedRetriever) and all(query in retriever.documents for query in queries)):
+        documents = {}
+        for query in queries:
+            start = perf_counter()
+            documents[query] = qa.retriever.invoke(query)
+            observe_retrieval(chain_type, to_ms(perf_counter() - start), 1)
+        retriever = PrefetchedRetriever(documents=documents, fallback=qa.retriever)
+        qa = RetrievalQA(combine_documents_chain=qa.combine_documents_chain, retriever=retriever, verbose=qa.verbose)
+
+    for example in examples:
+        query = example["query"]
+        docs = retriever.documents[query]
+        estimate = {"chain_type": chain_type, **estimate_strategy(qa.combine_documents_chain, docs, query)}
+        route = qa
+
+        if budget and not within_budget(estimate, **budget):
+            alternative = None
+            if reroute:
+                alternative = choose_strategy(estimate_all(llm, REROUTE_CHAIN_TYPES, docs, query), **budget)
+            if alternative is None:
+                print(f"Rejecting '{query}': estimated {estimate['total_tokens']} tokens is over budget")
+                route = None
+            else:
+                print(f"Rerouting '{query}' from {chain_type} to {alternative} to stay within budget")
+                if alternative not in rerouted_chains:
+                    rerouted_chains[alternative] = build_qa(llm, alternative, retriever, verbose=qa.verbose, limiter=limiter)
+                route = rerouted_chains[alternative]
+                estimate = {"chain_type": alternative, **estimate_strategy(route.combine_documents_chain, docs, query)}
+
+        estimates.append(estimate)
+        routes.append(route)
+
+    return estimates, routes
+
+def apply_concurrently(qa, examples, limiter=None, callbacks=None, routes=None, on_result=None, max_concurrency=None):
+    """
+    Runs the QA chain over every example in parallel, holding a limiter slot for each chain run
+    (concurrent map calls within it take further free slots, see concurrent_map).
+
+    Parameters:
+    - qa: The RetrievalQA chain to run.
+    - examples: A list of dictionaries with 'query' and 'answer' fields.
+    - limiter: Optional semaphore shared between strategies to cap the number of calls in flight.
+    - callbacks: Optional callback handlers attached to every call.
+    - routes: Optional chain per example (from preflight) to use instead of qa; None skips the example.
+    - on_result: Optional callable(index, prediction, measurement), called as each example completes.
+    - max_concurrency: The limiter's size, so no more threads are started than can hold a slot;
+      without it there is one thread per example.
+
+    Returns:
+    - The predictions in example order, and a matching list of per-example measurements:
+      wall time, queue time (waiting for a limiter slot), time to first token, retrieval time,
+      token counts and any chain error, plus the spans of every underlying LLM call. Queue time is kept out of the wall time so
+      other strategies can't skew it.
+    """
+    from modules.instrumentation import LatencyCallbackHandler, to_ms
+
+    limiter = limiter or nullcontext()
+    callbacks = callbacks or []
+    routes = routes or [qa] * len(examples)
+
+    def run_example(index, example, submitted, qa):
+        prediction, measurement = predict(example, submitted, qa)
+        if on_result is not None:
+            on_result(index, prediction, measurement)
+        return prediction, measurement
+
+    def predict(example, submitted, qa):
+        if qa is None:
+            # Rejected before any call was made
+            measurement = {"time": 0.0, "queue_time": 0.0, "ttft": None, "prompt_tokens": 0, "completion_tokens": 0, "llm_calls": [], "rejected": True}
+            return {**example, "result": "Rejected: estimated cost is over budget"}, measurement
+        # The phase is entered outside the try, so a profiler error can't be recorded as the prediction
+        with limiter, profile_phase("chain"):
+            start = perf_counter()
+            handler = LatencyCallbackHandler()
+            error = None
+            try:
+                prediction = qa.invoke(example, config={"callbacks": [*callbacks, handler]})
+            except ValueError as e:
+                prediction = {**example, "result": str(e)}
+                error = repr(e)
+            end = perf_counter()
+        measurement = {"time": to_ms(end - start), "queue_time": to_ms(start - submitted), "error": error, **handler.summary(start)}
+        return prediction, measurement
+
+    submitted = perf_counter()
+    workers = min(len(examples), max_concurrency) if max_concurrency else len(examples)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        outputs = list(pool.map(run_example, range(len(examples)), examples, [submitted] * len(examples), routes))
 
-    eval_chain = QAEvalChain.from_llm(llm)
-    graded_outputs = eval_chain.evaluate(examples, predictions)
+    predictions = [prediction for prediction, _ in outputs]
+    measurements = [measurement for _, measurement in outputs]
+    return predictions, measurements
+
+def evaluate(chain_type, qa, examples, llm, results_data, limiter=None, journal=None, trial=0, example_offset=0, max_concurrency=None):
+    from modules.batch_grading import BatchGrader
+    from modules.pre_grading import get_pre_grader
+
+    # LLM assisted evaluation, one trial of every example (numbered from example_offset, for a shard)
+    # With a journal, every prediction and grade is recorded as soon as it completes,
+    # and examples a previous (crashed) run already completed are not run again
+    cells = [(journal.get(chain_type, eg, trial) if journal else None) or {} for eg in examples]
+    to_predict = [i for i, cell in enumerate(cells) if "prediction" not in cell]
+
+    # Predict each example's cost up front, rerouting or rejecting what is over budget
+    with profile_phase("preflight"):
+        estimates, routes = preflight(chain_type, qa, [examples[i] for i in to_predict], llm, limiter)
+
+    def journal_prediction(index, prediction, measurement):
+        i = to_predict[index]
+        cells[i].update(prediction=prediction, measurement=measurement, estimate=estimates[index])
+        observe_prediction(chain_type, measurement)
+        if journal is not None:
+            journal.record(chain_type, examples[i], trial, prediction=prediction, measurement=measurement, estimate=estimates[index])
+
+    # Time and count tokens for every example and every LLM call it makes
+    apply_concurrently(qa, [examples[i] for i in to_predict], limiter, routes=routes, on_result=journal_prediction, max_concurrency=max_concurrency)
+
+    # Rejected examples were never answered, so there is nothing to grade
+    rejected = [i for i, cell in enumerate(cells) if cell["measurement"].get("rejected")]
+    for i in rejected:
+        if "result" not in cells[i]:
+            cells[i].update(result="REJECTED", grade_time=None, grade_source="rejected")
+            if journal is not None:
+                journal.record(chain_type, examples[i], trial, result="REJECTED", grade_time=None, grade_source="rejected")
+
+    # Obvious grades are decided locally; the LLM grades the rest, many examples per call
+    to_grade = [i for i, cell in enumerate(cells) if "result" not in cell]
+    with profile_phase("grading"):
+        pre_grader = get_pre_grader()
+        verdicts = pre_grader.grade([examples[i] for i in to_grade], [cells[i]["prediction"] for i in to_grade]) if pre_grader else [None] * len(to_grade)
+
+        # Only what the local checks couldn't decide goes to the LLM
+        to_llm = [i for i, verdict in zip(to_grade, verdicts) if verdict is None]
+        graded_outputs = BatchGrader(llm).grade([examples[i] for i in to_llm], [cells[i]["prediction"] for i in to_llm], limiter)
+    graded = {i: verdict for i, verdict in zip(to_grade, verdicts) if verdict is not None}
+    graded.update((i, {**output, "grade_source": "llm"}) for i, output in zip(to_llm, graded_outputs))
+
+    for i in to_grade:
+        grade_calls = graded[i].get('llm_calls', [])
+        cells[i].update(result=graded[i]['results'], grade_time=graded[i]['grade_time'], grade_source=graded[i]['grade_source'])
+        observe_grade(chain_type, cells[i]["grade_time"], cells[i]["grade_source"], grade_calls)
+        if journal is not None:
+            journal.record(chain_type, examples[i], trial, result=cells[i]["result"], grade_time=cells[i]["grade_time"], grade_source=cells[i]["grade_source"],
+                           grade_calls=grade_calls)
 
     # turn to object and return
     # using llm as real answer and predicted answer are not similar in a string match sense, e.g. look at example_llm_eval.txt
     for i, eg in enumerate(examples):
         
-        example_number = i
-        query = predictions[i]['query']
-        answer = predictions[i]['answer']
-        predicted_answer = predictions[i]['result']
-        result = graded_outputs[i]['results']
+        example_number = example_offset + i
+        prediction = cells[i]["prediction"]
+        query = prediction['query']
+        answer = prediction['answer']
+        predicted_answer = prediction['result']
+        result = cells[i]['result']
+        measurement = cells[i]["measurement"]
+        if measurement.get("rejected"):
+            # Never run, so no time or tokens to count towards the strategy
+            measurement = {**measurement, "time": None, "queue_time": None, "prompt_tokens": None, "completion_tokens": None}
+        tokens_used = None if measurement.get("rejected") else measurement["prompt_tokens"] + measurement["completion_tokens"]
+        grade_time = cells[i]["grade_time"]
+        grade_source = cells[i].get("grade_source")
+        estimate = cells[i]["estimate"]
+        routed_to = estimate["chain_type"] if estimate["chain_type"] != chain_type else None
         
         print(f"Example {example_number}:")
         print("Question: " + query)
         print("Real Answer: " + answer)
         print("Predicted Answer: " + predicted_answer)
-        print("Predicted Grade: " + result)
+        print(f"Predicted Grade: {result} ({grade_source})")
+        if measurement.get("rejected"):
+            print("Time: rejected before any LLM call")
+        else:
+            print(f"Time: {measurement['time']:.03f}ms, LLM calls: {len(measurement['llm_calls'])}, Tokens: {tokens_used}")
+        print(f"Estimated: {estimate['latency']:.03f}ms, LLM calls: {estimate['calls']}, Tokens: {estimate['total_tokens']}")
         print()
 
-    results_data = add_to_results_list(results_data, chain_type, query, time=td, tokens_used=tokens_used, example_number=i, predicted_answer=predicted_answer, answer=answer, result=result)
+        results_data = add_to_results_list(results_data, chain_type, query, time=measurement["time"], tokens_used=tokens_used, example_number=example_number, 
+                                           predicted_answer=predicted_answer, answer=answer, result=result, 
+                                           queue_time=measurement["queue_time"], ttft=measurement["ttft"], 
+                                           prompt_tokens=measurement["prompt_tokens"], completion_tokens=measurement["completion_tokens"], 
+                                           llm_calls=measurement["llm_calls"], grade_time=grade_time, 
+                                           estimated_tokens=estimate["total_tokens"], estimated_calls=estimate["calls"], 
+                                           estimated_time=estimate["latency"], routed_to=routed_to, grade_source=grade_source, trial=trial)
     return results_data
 
-def add_to_results_list(results_data, chain_type, query, time=None, tokens_used=None, example_number=None, answer=None, predicted_answer=None, result=None):
-    found = False
-    for item in results_data:
-        if item.chain_type == chain_type:
-            # Update the existing dictionary
-            item.append_evaluation(time=time, tokens_used=tokens_used, example_number=example_number, 
-                         predicted_query=query, answer=answer, predicted_answer=predicted_answer, result=result)
-            found = True
-            break
-
-    if not found:
-        # Append a new instance of ResultsData if no matching chain_type was found
-        results_data.append(ResultsData(chain_type=chain_type, time=time, tokens_used=tokens_used, 
-                                        example_number=example_number, predicted_query=query, 
-                                        answer=answer, predicted_answer=predicted_answer, 
-                                        result=result))
-        
-    return results_data
\ No newline at end of file
+def add_to_results_list(results_data, chain_type, query, time=None, tokens_used=None, example_number=None, answer=None, predicted_answer=None, result=None, 
+                        queue_time=None, ttft=None, prompt_tokens=None, completion_tokens=None, llm_calls=None, grade_time=None, 
+                        estimated_tokens=None, estimated_calls=None, estimated_time=None, routed_to=None, grade_source=None, trial=None):
+    # Columnar store: an O(1) append whatever the chain type or number of results
+    return results_data.append(chain_type, query=query, time=time, tokens_used=tokens_used, example_number=example_number, 
+                               answer=answer, predicted_answer=predicted_answer, result=result, 
+                               queue_time=queue_time, ttft=ttft, prompt_tokens=prompt_tokens, 
+                               completion_tokens=completion_tokens, llm_calls=llm_calls, grade_time=grade_time, 
+                               estimated_tokens=estimated_tokens, estimated_calls=estimated_calls, 
+                               estimated_time=estimated_time, routed_to=routed_to, grade_source=grade_source, trial=trial)
@@ -0,0 +1,140 @@
+import re
+import time
+import hashlib
+from typing import Any, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from modules.latency_model import default_latency
+from modules.text_stats import count_tokens, content_words, overlap
+
+# Offline stand-ins for ChatOpenAI and OpenAIEmbeddings, so benchmarks can run without network or cost
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+QUESTION_RE = re.compile(r"(?:question(?: is as follows)?|QUESTION)\s*:\s*(.+)", re.IGNORECASE)
+
+def best_passage(question, context):
+    """
+    Picks the sentence of the context sharing the most content words with the question,
+    together with the sentence after it, or "" when no sentence shares any.
+    """
+    question_words = content_words(question)
+    sentences = [s.strip() for s in SENTENCE_RE.split(context) if s.strip() and question not in s]
+    scored = [(len(question_words & content_words(s)), -len(s), i) for i, s in enumerate(sentences)]
+    best = max(scored, default=(0, 0, 0))
+    return " ".join(sentences[best[2]:best[2] + 2]) if best[0] else ""
+
+def fake_completion(prompt, question=None, existing_answer=None):
+    """
+    Deterministic reply to the prompts used in this project, shaped so LangChain's
+    output parsers accept it: QAGenerateChain, QAEvalChain, map_rerank scores and plain answers.
+    Chat prompts pass the question (and refine's existing answer) separately; plain prompts
+    carry it after a "Question:" label.
+    """
+    if "coming up with questions" in prompt:
+        # The document arrives as a Document repr, with its newlines escaped
+        document = prompt.replace("\\n", "\n")
+        name = re.search(r"^name:\s*(.+)$", document, re.MULTILINE)
+        description = re.search(r"^description:\s*(.+)$", document, re.MULTILINE)
+        subject = name.group(1).strip() if name else "this product"
+        answer = SENTENCE_RE.split(description.group(1).strip())[0] if description else subject
+        return f"QUESTION: What is a key feature of the {subject}?\nANSWER: {answer}"
+
+    if "grading" in prompt and "GRADES:" in prompt:
+        # Batched grading: one verdict line per numbered item after the format example
+        items = re.findall(r"ITEM (\d+)\nQUESTION:.*?STUDENT ANSWER:\s*(.*?)\s*TRUE ANSWER:\s*(.*?)\s*(?=ITEM \d+\n|Reply with)", prompt.rsplit("Begin!", 1)[-1], re.DOTALL)
+        return "\n".join(f"ITEM {n}: {'CORRECT' if overlap(true, student) >= 0.5 else 'INCORRECT'}" for n, student, true in items)
+
+    if "grading" in prompt:
+        # Skip the format example and grade the real submission after it
+        graded = re.search(r"STUDENT ANSWER:\s*(.*?)\s*TRUE ANSWER:\s*(.*?)\s*GRADE:", prompt.rsplit("Begin!", 1)[-1], re.DOTALL)
+        if graded and overlap(graded.group(2), graded.group(1)) >= 0.5:
+            return "CORRECT"
+        return "INCORRECT"
+
+    if question is None:
+        questions = QUESTION_RE.findall(prompt)
+        question = questions[-1].strip() if questions else ""
+    answer = best_passage(question, prompt)
+
+    # Refine keeps its existing answer unless the new context answers the question better
+    if existing_answer and overlap(question, existing_answer) >= overlap(question, answer):
+        answer = existing_answer
+
+    if "Score:" in prompt:
+        return f"{answer or 'This document does not answer the question'}\nScore: {round(overlap(question, answer) * 100)}"
+    return answer or "I don't know."
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic offline chat model. Replies come from fake_completion, token counts
+    are simulated with count_tokens and reported like OpenAI's, and every call sleeps
+    according to the latency model.
+    """
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+    latency: Optional[Any] = None
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def get_num_tokens(self, text):
+        return count_tokens(text)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        latency = self.latency or default_latency
+        prompt = "\n\n".join(str(message.content) for message in messages)
+        # Chat prompts put the question in its own (shortest) human message, after any AI answer so far
+        human = [str(m.content) for m in messages if m.type == "human"]
+        ai = [str(m.content) for m in messages if m.type == "ai"]
+        question = min(human, key=len) if len(messages) > 1 and human else None
+        text = fake_completion(prompt, question, ai[-1] if ai else None)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(text)
+
+        latency.wait_for_slot()
+        time.sleep(latency.time_to_first_token(prompt_tokens))
+        if run_manager and text:
+            run_manager.on_llm_new_token(text.split()[0])
+        time.sleep(latency.generation_time(completion_tokens))
+
+        generation = ChatGeneration(message=AIMessage(content=text))
+        token_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                       "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[generation], llm_output={"token_usage": token_usage, "model_name": self.model_name})
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: each word is hashed into one of `size` buckets
+    with a hashed sign, and the vector is L2 normalised. Texts sharing words end up close.
+    """
+
+    def __init__(self, size=256, latency=None):
+        self.size = size
+        self.latency = latency
+        self.model = f"hashing-{size}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        latency = self.latency or default_latency
+        # One simulated request per batch, like the OpenAI embeddings endpoint
+        latency.wait_for_slot()
+        time.sleep(latency.time_to_first_token(sum(count_tokens(t) for t in texts)))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(v * v for v in vector) ** 0.5
+        return [v / norm for v in vector] if norm else vector
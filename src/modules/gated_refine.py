@@ -0,0 +1,97 @@
+import os
+import re
+from typing import Any
+from langchain.chains.combine_documents.refine import RefineDocumentsChain
+from modules.text_stats import overlap
+
+# The refine prompt's canned reply when a document adds nothing, e.g. "The new context provided is not useful
+# for refining the original answer". Only at the start: an answer can say "not relevant" and still be a refinement
+NO_UPDATE_RE = re.compile(r"\W*(?:the )?(?:new |additional )?context(?: provided)? (?:is not|isn't|does not seem) (?:useful|relevant|helpful)\b", re.IGNORECASE)
+
+def normalise_answer(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+class GatedRefineDocumentsChain(RefineDocumentsChain):
+    """
+    Refine that only spends a sequential LLM round-trip on documents worth it.
+
+    Each retrieved document is scored against the question locally, by lexical overlap
+    (the fraction of the question's content words it contains). Documents below
+    min_relevance are skipped and the rest refined
+    most relevant first. A refine step that leaves the answer unchanged, or replies that
+    the context isn't useful, keeps the previous answer; after patience such steps in a
+    row the answer has stabilised and the remaining documents are skipped.
+    """
+
+    min_relevance: float = 0.3
+    patience: int = 1
+    question_key: str = "question"
+
+    def relevance(self, question, docs):
+        return [overlap(question, doc.page_content) for doc in docs]
+
+    def select_docs(self, docs, **kwargs):
+        """The documents to refine over, most relevant first; always at least the best one."""
+        question = kwargs.get(self.question_key)
+        if not docs or not question:
+            return docs
+        scores = self.relevance(question, docs)
+        # Stable sort, so ties keep the retriever's order
+        ranked = sorted(range(len(docs)), key=lambda i: -scores[i])
+        kept = [docs[i] for i in ranked if scores[i] >= self.min_relevance]
+        return kept or [docs[ranked[0]]]
+
+    def is_update(self, answer, refined):
+        return not NO_UPDATE_RE.match(refined) and normalise_answer(refined) != normalise_answer(answer)
+
+    def combine_docs(self, docs, callbacks=None, **kwargs: Any):
+        docs = self.select_docs(docs, **kwargs)
+        inputs = self._construct_initial_inputs(docs, **kwargs)
+        res = self.initial_llm_chain.predict(callbacks=callbacks, **inputs)
+        refine_steps = [res]
+        unchanged = 0
+        for doc in docs[1:]:
+            if unchanged >= self.patience:
+                break
+            inputs = {**self._construct_refine_inputs(doc, res), **kwargs}
+            refined = self.refine_llm_chain.predict(callbacks=callbacks, **inputs)
+            refine_steps.append(refined)
+            if not self.is_update(res, refined):
+                unchanged += 1
+            else:
+                res, unchanged = refined, 0
+        return self._construct_result(refine_steps, res)
+
+    async def acombine_docs(self, docs, callbacks=None, **kwargs: Any):
+        docs = self.select_docs(docs, **kwargs)
+        inputs = self._construct_initial_inputs(docs, **kwargs)
+        res = await self.initial_llm_chain.apredict(callbacks=callbacks, **inputs)
+        refine_steps = [res]
+        unchanged = 0
+        for doc in docs[1:]:
+            if unchanged >= self.patience:
+                break
+            inputs = {**self._construct_refine_inputs(doc, res), **kwargs}
+            refined = await self.refine_llm_chain.apredict(callbacks=callbacks, **inputs)
+            refine_steps.append(refined)
+            if not self.is_update(res, refined):
+                unchanged += 1
+            else:
+                res, unchanged = refined, 0
+        return self._construct_result(refine_steps, res)
+
+def enable_relevance_gate(combine_chain, min_relevance=None, patience=None):
+    """
+    Switches a refine combine-documents chain to GatedRefineDocumentsChain, for the "gated_refine" chain type.
+    min_relevance defaults to REFINE_MIN_RELEVANCE (0.3) and patience to REFINE_PATIENCE (1).
+    Other chain types are returned unchanged.
+    """
+    if not isinstance(combine_chain, RefineDocumentsChain):
+        return combine_chain
+
+    fields = {name: getattr(combine_chain, name) for name in RefineDocumentsChain.__fields__ if name != "callback_manager"}
+    return GatedRefineDocumentsChain(
+        **fields,
+        min_relevance=min_relevance if min_relevance is not None else float(os.getenv("REFINE_MIN_RELEVANCE", 0.3)),
+        patience=patience if patience is not None else int(os.getenv("REFINE_PATIENCE", 1)),
+    )
@@ -0,0 +1,120 @@
+import threading
+from time import perf_counter
+from langchain_core.callbacks import BaseCallbackHandler
+
+def to_ms(seconds):
+    # Durations are reported in milliseconds throughout the results
+    return seconds * 10**3
+
+class LatencyCallbackHandler(BaseCallbackHandler):
+    """
+    Records a span for every LLM call made while the handler is attached.
+
+    Each span holds the call's wall time, queue time and time to first token (all ms),
+    plus the prompt and completion token counts reported by the provider, and whether the
+    response came from the cache. Time spent in retrievers is recorded alongside.
+    LangChain runs a batch of prompts (e.g. the map step) one after another, so a call
+    in a batch only really starts once its predecessor ends; that wait is its queue time.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._open = {}
+        self._batches = {}
+        self._retrievals = {}
+        self.retrieval_time = 0.0
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("batch_size", 1))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("batch_size", 1))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            span = self._open.get(run_id)
+            if span is not None and span["first_token"] is None:
+                span["first_token"] = perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage", {})
+        # Responses served from the cache come back without any llm_output
+        self._end(run_id, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), None, response.llm_output is None)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, 0, 0, repr(error))
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        with self._lock:
+            self._retrievals[run_id] = perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        now = perf_counter()
+        with self._lock:
+            start = self._retrievals.pop(run_id, None)
+            if start is not None:
+                self.retrieval_time += to_ms(now - start)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.on_retriever_end(None, run_id=run_id)
+
+    def _start(self, run_id, parent_run_id, batch_size):
+        now = perf_counter()
+        with self._lock:
+            # Calls started together by one generate() share a batch and run in order
+            batch = self._batches.get(parent_run_id)
+            if batch is None or batch["remaining"] == 0:
+                batch = {"remaining": batch_size, "last_end": now}
+                self._batches[parent_run_id] = batch
+            batch["remaining"] -= 1
+            self._open[run_id] = {"start": now, "first_token": None, "batch": batch}
+
+    def _end(self, run_id, prompt_tokens, completion_tokens, error, cached=False):
+        now = perf_counter()
+        with self._lock:
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return
+            batch = span["batch"]
+            effective_start = max(span["start"], batch["last_end"])
+            batch["last_end"] = now
+            # Without streaming no token event fires, so the first token arrives with the response
+            first_token = span["first_token"] or now
+            self.spans.append({
+                "start": span["start"],
+                "end": now,
+                "time": to_ms(now - effective_start),
+                "queue_time": to_ms(effective_start - span["start"]),
+                "ttft": to_ms(max(first_token - effective_start, 0)),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "error": error,
+                "cached": cached,
+            })
+
+    def summary(self, start):
+        """
+        Aggregates the recorded spans for a single example that began at `start` (perf_counter).
+        Time to first token is measured to the first token of the last call, which produces the answer.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["end"])
+        if spans:
+            final = spans[-1]
+            ttft = to_ms(final["end"] - start) - final["time"] + final["ttft"]
+        else:
+            ttft = None
+        return {
+            "ttft": ttft,
+            "retrieval_time": self.retrieval_time,
+            "prompt_tokens": sum(span["prompt_tokens"] for span in spans),
+            "completion_tokens": sum(span["completion_tokens"] for span in spans),
+            "llm_calls": [{k: v for k, v in span.items() if k not in ("start", "end")} for span in spans],
+        }
+
+    def calls(self):
+        """The recorded spans in the order the calls ended, as in summary's 'llm_calls'."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["end"])
+        return [{k: v for k, v in span.items() if k not in ("start", "end")} for span in spans]
@@ -0,0 +1,47 @@
+import os
+import time
+import threading
+
+class LatencyModel:
+    """
+    Simulated provider latency: a fixed overhead per request plus a cost per prompt and
+    completion token, with an optional requests-per-minute limit shared by every caller.
+    Times are in ms.
+    """
+
+    def __init__(self, overhead_ms=0.0, ms_per_prompt_token=0.0, ms_per_completion_token=0.0, requests_per_minute=None):
+        self.overhead_ms = overhead_ms
+        self.ms_per_prompt_token = ms_per_prompt_token
+        self.ms_per_completion_token = ms_per_completion_token
+        self.requests_per_minute = requests_per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        rpm = os.getenv("FAKE_LLM_RPM")
+        return cls(
+            overhead_ms=float(os.getenv("FAKE_LLM_OVERHEAD_MS", 0)),
+            ms_per_prompt_token=float(os.getenv("FAKE_LLM_MS_PER_PROMPT_TOKEN", 0)),
+            ms_per_completion_token=float(os.getenv("FAKE_LLM_MS_PER_COMPLETION_TOKEN", 0)),
+            requests_per_minute=float(rpm) if rpm else None,
+        )
+
+    def wait_for_slot(self):
+        # Space requests evenly so no more than requests_per_minute start in any minute
+        if not self.requests_per_minute:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 60.0 / self.requests_per_minute
+        time.sleep(slot - now)
+
+    def time_to_first_token(self, prompt_tokens):
+        return (self.overhead_ms + prompt_tokens * self.ms_per_prompt_token) / 10**3
+
+    def generation_time(self, completion_tokens):
+        return completion_tokens * self.ms_per_completion_token / 10**3
+
+# The fake backend's latency (FAKE_LLM_*), one per process so rate limits hold across every fake model and embedding
+default_latency = LatencyModel.from_env()
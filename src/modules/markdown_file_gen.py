@@ -1,25 +1,67 @@
-def results_data_to_markdown_table(results_data_list):
-    headers = ["Chain Type", "Eval Time", "Tokens Used", "Example Number", "Predicted Query", "Predicted Answer", "Answer", "Result"]
+def format_ms(value):
+    # Milliseconds to 3 d.p., blank when not measured
+    return f"{value:.3f}" if value is not None else ""
+
+def results_data_to_markdown_table(results_data):
+    headers = ["Chain Type", "Eval Time", "Queue Time", "TTFT", "LLM Calls", "Tokens Used", "Prompt Tokens", "Completion Tokens", "Est. Tokens", "Est. Calls", "Example Number", "Trial", "Predicted Query", "Predicted Answer", "Answer", "Result", "Grade Source"]
     markdown_table = "| " + " | ".join(headers) + " |\n"
     markdown_table += "| " + " | ".join(["---"] * len(headers)) + " |\n"
 
-    for data in results_data_list:
-        for eval in data.eval:
-            # Ensure every value is a string, handling None and ensuring dict values are properly formatted or avoided
-            row = [
-                data.chain_type,
-                str(eval.get("time", "")),
-                str(eval.get("tokens_used", "")),
-                str(eval.get("example_number", "")),
-                eval.get("query", ""),
-                eval.get("predicted_answer", "") if eval.get("predicted_answer") is not None else "",
-                eval.get("answer", ""),
-                eval.get("result", "") if eval.get("result") is not None else ""
-            ]
-            markdown_table += "| " + " | ".join([str(item) for item in row]) + " |\n"
+    # Rows grouped by chain type, in the order the chain types were first run
+    df = results_data.to_frame()
+    order = {chain_type: i for i, chain_type in enumerate(results_data.chain_types())}
+    df = df.iloc[df["chain_type"].map(order).astype(int).argsort(kind="stable")]
+
+    for eval in df.astype(object).where(df.notna(), None).to_dict("records"):
+        chain_type = eval["chain_type"] if not eval["routed_to"] else f"{eval['chain_type']} → {eval['routed_to']}"
+        row = [
+            chain_type,
+            format_ms(eval["time"]),
+            format_ms(eval["queue_time"]),
+            format_ms(eval["ttft"]),
+            eval["llm_calls"],
+            eval["tokens_used"],
+            eval["prompt_tokens"],
+            eval["completion_tokens"],
+            eval["estimated_tokens"],
+            eval["estimated_calls"],
+            eval["example_number"],
+            eval["trial"],
+            eval["query"],
+            eval["predicted_answer"],
+            eval["answer"],
+            eval["result"],
+            eval["grade_source"]
+        ]
+        # Blank when not recorded
+        markdown_table += "| " + " | ".join(["" if item is None else str(item) for item in row]) + " |\n"
     
     return markdown_table
 
+def latency_summary_to_markdown_table(results_data):
+    # Tail latency and dispersion per chain type, across every trial
+    headers = ["Chain Type", "Trials", "Samples", "Mean Time", "95% CI", "P50", "P90", "P99", "Mean Tokens", "Tokens Std", "Tokens CV"]
+    markdown_table = "| " + " | ".join(headers) + " |\n"
+    markdown_table += "| " + " | ".join(["---"] * len(headers)) + " |\n"
+
+    summary = results_data.latency_summary()
+    for stats in summary.astype(object).where(summary.notna(), None).to_dict("records"):
+        row = [
+            stats["chain_type"],
+            stats["trials"],
+            stats["samples"],
+            format_ms(stats.get("mean")),
+            f"{format_ms(stats.get('ci_low'))} – {format_ms(stats.get('ci_high'))}" if stats.get("ci_low") is not None else "",
+            format_ms(stats.get("p50")),
+            format_ms(stats.get("p90")),
+            format_ms(stats.get("p99")),
+            f"{stats['tokens_mean']:.1f}" if stats.get("tokens_mean") is not None else "",
+            f"{stats['tokens_std']:.1f}" if stats.get("tokens_std") is not None else "",
+            f"{stats['tokens_cv']:.3f}" if stats.get("tokens_cv") is not None else ""
+        ]
+        markdown_table += "| " + " | ".join(["" if item is None else str(item) for item in row]) + " |\n"
+
+    return markdown_table
 
 def write_markdown_table_to_file(markdown_table, filename):
     # Write the markdown table to the specified file
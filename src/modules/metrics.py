@@ -0,0 +1,219 @@
+import os
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from a local pre-grade up to a slow refine over many documents
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+class Histogram:
+    """Observations per label set, counted into cumulative buckets as Prometheus expects."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", {**labels, "le": format_value(bound)}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, counts[-1]
+
+class MetricsRegistry:
+    """
+    The metrics of a process, rendered in the Prometheus text exposition format.
+    They can be served over HTTP for scraping, or written to a file (e.g. for node_exporter's
+    textfile collector) that is replaced atomically so readers never see half a scrape.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        self.metrics.append(Counter(name, documentation, labelnames))
+        return self.metrics[-1]
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.metrics.append(Histogram(name, documentation, labelnames, buckets))
+        return self.metrics[-1]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves the metrics at http://host:port/metrics from a daemon thread. Returns the server."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would drown the run's own output
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+REGISTRY = MetricsRegistry()
+
+E2E_LATENCY = REGISTRY.histogram("qa_e2e_latency_seconds", "Wall time of one question through the QA chain, excluding queueing.", ["chain_type"])
+RETRIEVAL_LATENCY = REGISTRY.histogram("qa_retrieval_latency_seconds", "Time spent embedding and searching for one question (its share of a batch).", ["chain_type"])
+LLM_CALL_LATENCY = REGISTRY.histogram("qa_llm_call_latency_seconds", "Wall time of one LLM call not served from the response cache.", ["chain_type", "phase"])
+GRADING_LATENCY = REGISTRY.histogram("qa_grading_latency_seconds", "Time spent grading one prediction.", ["chain_type", "grade_source"])
+TOKENS = REGISTRY.counter("qa_tokens_total", "Tokens used answering and grading.", ["chain_type", "phase", "kind"])
+LLM_CALLS = REGISTRY.counter("qa_llm_calls_total", "LLM calls made answering and grading, cached or not.", ["chain_type", "phase"])
+CACHE_HITS = REGISTRY.counter("qa_llm_cache_hits_total", "LLM calls served from the response cache.", ["chain_type", "phase"])
+
+# chain_type of the retrieval done once for every strategy
+ALL_STRATEGIES = "all"
+ERRORS = REGISTRY.counter("qa_errors_total", "Failed LLM calls and chain runs.", ["chain_type", "kind"])
+QUESTIONS = REGISTRY.counter("qa_questions_total", "Questions answered, by outcome.", ["chain_type", "outcome"])
+
+def observe_prediction(chain_type, measurement):
+    """Records one example's measurement (see evaluation.apply_concurrently)."""
+    if measurement.get("rejected"):
+        QUESTIONS.inc(chain_type=chain_type, outcome="rejected")
+        return
+    QUESTIONS.inc(chain_type=chain_type, outcome="error" if measurement.get("error") else "answered")
+    # Its retrieval_time is a lookup of documents retrieved in a batch, see observe_retrieval
+    E2E_LATENCY.observe(measurement["time"] / 10**3, chain_type=chain_type)
+    if measurement.get("error"):
+        ERRORS.inc(chain_type=chain_type, kind="chain")
+    observe_llm_calls(chain_type, "answer", measurement["llm_calls"])
+
+def observe_llm_calls(chain_type, phase, llm_calls):
+    """Records the spans of LLM calls (see LatencyCallbackHandler) made in a phase, "answer" or "grading"."""
+    for span in llm_calls:
+        LLM_CALLS.inc(chain_type=chain_type, phase=phase)
+        TOKENS.inc(span["prompt_tokens"], chain_type=chain_type, phase=phase, kind="prompt")
+        TOKENS.inc(span["completion_tokens"], chain_type=chain_type, phase=phase, kind="completion")
+        if span.get("error"):
+            ERRORS.inc(chain_type=chain_type, kind="llm")
+        elif span.get("cached"):
+            CACHE_HITS.inc(chain_type=chain_type, phase=phase)
+        else:
+            LLM_CALL_LATENCY.observe(span["time"] / 10**3, chain_type=chain_type, phase=phase)
+
+def observe_retrieval(chain_type, retrieval_time, queries):
+    """Records a batch retrieval that took retrieval_time ms, as an equal share for each of its queries."""
+    for _ in range(queries):
+        RETRIEVAL_LATENCY.observe(retrieval_time / queries / 10**3, chain_type=chain_type)
+
+def observe_grade(chain_type, grade_time, grade_source, llm_calls=()):
+    # A grading batch's calls come with its first item
+    if grade_time is not None:
+        GRADING_LATENCY.observe(grade_time / 10**3, chain_type=chain_type, grade_source=grade_source or "llm")
+    observe_llm_calls(chain_type, "grading", llm_calls or ())
+
+class MetricsExporter:
+    """
+    Exposes REGISTRY while a run is going: on http://127.0.0.1:METRICS_PORT/metrics and/or
+    by rewriting METRICS_FILE every METRICS_INTERVAL seconds (default 5) and once more on stop().
+    """
+
+    def __init__(self, port=None, path=None, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.server = REGISTRY.serve(port) if port else None
+        self._stopped = threading.Event()
+        self._thread = None
+        if path:
+            self._thread = threading.Thread(target=self._write_periodically, daemon=True)
+            self._thread.start()
+
+    def _write_periodically(self):
+        while not self._stopped.wait(self.interval):
+            REGISTRY.write(self.path)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            REGISTRY.write(self.path)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+def start_metrics_exporter():
+    """Starts the exporter configured by METRICS_PORT and METRICS_FILE, or returns None when neither is set."""
+    port, path = os.getenv("METRICS_PORT"), os.getenv("METRICS_FILE")
+    if not port and not path:
+        return None
+    return MetricsExporter(int(port) if port else None, path, float(os.getenv("METRICS_INTERVAL", 5)))
@@ -0,0 +1,164 @@
+import os
+import json
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+class NumpyVectorStore(VectorStore):
+    """
+    Dense in-process vector store: L2-normalised embeddings held in one contiguous
+    float32 (or float16) NumPy matrix, answered with a matrix product plus argpartition top-k.
+
+    With a persist_directory, the matrix is saved as vectors.npy and memory-mapped on open,
+    so cold start doesn't read it; documents sit alongside in docs.jsonl. Pass persist=False
+    to add_texts/delete to batch several changes into one write.
+    """
+
+    def __init__(self, embedding_function, persist_directory=None, dtype="float32"):
+        self._embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.dtype = np.dtype(dtype)
+        self._vectors = None
+        self._pending = []
+        self._search_matrix = None
+        self._ids = []
+        self._documents = []
+
+        if persist_directory and os.path.exists(os.path.join(persist_directory, "vectors.npy")):
+            self._vectors = np.load(os.path.join(persist_directory, "vectors.npy"), mmap_mode="r")
+            self.dtype = self._vectors.dtype
+            with open(os.path.join(persist_directory, "docs.jsonl"), encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    self._ids.append(record["id"])
+                    self._documents.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _normalise(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add_texts(self, texts, metadatas=None, ids=None, persist=True, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+
+        # Re-adding an id replaces its row
+        existing = set(self._ids)
+        self.delete([id for id in ids if id in existing], persist=False)
+
+        # Batches are concatenated once, when next needed, so building a large index stays linear
+        self._pending.append(self._normalise(self._embedding_function.embed_documents(texts)).astype(self.dtype))
+        self._search_matrix = None
+        self._ids.extend(ids)
+        self._documents.extend(Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas))
+        if persist:
+            self.persist()
+        return ids
+
+    def _matrix(self):
+        if self._pending:
+            self._vectors = np.concatenate(([] if self._vectors is None else [self._vectors]) + self._pending)
+            self._pending = []
+        return self._vectors
+
+    def delete(self, ids=None, persist=True, **kwargs):
+        if not ids or self._matrix() is None:
+            return True
+        removed = set(ids)
+        keep = [i for i, id in enumerate(self._ids) if id not in removed]
+        self._vectors = np.ascontiguousarray(self._vectors[keep])
+        self._search_matrix = None
+        self._ids = [self._ids[i] for i in keep]
+        self._documents = [self._documents[i] for i in keep]
+        if persist:
+            self.persist()
+        return True
+
+    def get(self, include=None, **kwargs):
+        # Chroma-style view of the stored rows
+        return {
+            "ids": list(self._ids),
+            "documents": [doc.page_content for doc in self._documents],
+            "metadatas": [doc.metadata for doc in self._documents],
+        }
+
+    def persist(self):
+        """Writes the matrix and documents to persist_directory, swapping each file in whole."""
+        if not self.persist_directory:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        vectors_path = os.path.join(self.persist_directory, "vectors.npy")
+        with open(vectors_path + ".tmp", "wb") as file:
+            np.save(file, np.ascontiguousarray(self._matrix()))
+        docs_path = os.path.join(self.persist_directory, "docs.jsonl")
+        with open(docs_path + ".tmp", "w", encoding="utf-8") as file:
+            for id, doc in zip(self._ids, self._documents):
+                file.write(json.dumps({"id": id, "page_content": doc.page_content, "metadata": doc.metadata}) + "\n")
+        # Drop the memory map of the old file before replacing it
+        self._vectors = np.array(self._vectors)
+        self._search_matrix = None
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(docs_path + ".tmp", docs_path)
+
+    def _float32_vectors(self):
+        # float16 storage is converted once per change rather than on every query
+        if self._search_matrix is None:
+            self._search_matrix = np.asarray(self._matrix(), dtype=np.float32)
+        return self._search_matrix
+
+    def top_k(self, query_vectors, k):
+        """
+        Top-k rows by cosine similarity for each query vector (one row per query).
+        Returns (indices, scores), both of shape (queries, k), best match first.
+        """
+        queries = self._normalise(np.atleast_2d(query_vectors))
+        if not len(self._ids):
+            return np.empty((len(queries), 0), dtype=int), np.empty((len(queries), 0))
+        scores = queries @ self._float32_vectors().T
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), (len(queries), k))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+    def batch_similarity_search_by_vector(self, embeddings, k=4):
+        """Top-k documents for many query vectors, resolved with a single matrix product."""
+        indices, _ = self.top_k(embeddings, k)
+        return [[self._documents[i] for i in row] for row in indices]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        indices, scores = self.top_k(embedding, k)
+        return [(self._documents[i], float(s)) for i, s in zip(indices[0], scores[0])]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] mapped to a [0, 1] relevance
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, dtype="float32", **kwargs):
+        store = cls(embedding, persist_directory=persist_directory, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
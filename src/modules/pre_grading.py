@@ -0,0 +1,160 @@
+import os
+import re
+import string
+from collections import Counter
+from time import perf_counter
+import numpy as np
+from modules.backend import get_embedding
+from modules.instrumentation import to_ms
+
+# Predictions that decline to answer, e.g. "There is no information provided about ..."
+REFUSAL_RE = re.compile(
+    r"\b(?:no information|not (?:provided|mentioned|specified)|(?:don't|do not|doesn't|does not) (?:know|mention|provide|say)"
+    r"|cannot (?:answer|determine)|can't (?:answer|determine)|not (?:useful|relevant) for)\b",
+    re.IGNORECASE,
+)
+
+ARTICLES_RE = re.compile(r"\b(?:a|an|the)\b")
+# Words that flip a claim, and numbers: token overlap can't tell "is waterproof" from "is not waterproof"
+NEGATION_RE = re.compile(r"\b(?:no|not|never|none|nothing|neither|nor|without|cannot|\w+n't)\b", re.IGNORECASE)
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+PUNCTUATION = set(string.punctuation)
+
+# (cosine_correct, cosine_incorrect) per embedding model, from calibrate_cosine_thresholds.
+# Cosine scales differ between models, so the cosine check only runs for a model listed here,
+# or with PRE_GRADE_COSINE_THRESHOLDS="<correct>,<incorrect>" set for the run's model.
+# Calibrate on grades from a real LLM grader: none are shipped yet.
+COSINE_THRESHOLDS = {}
+
+def normalise(text):
+    # Lowercase, drop punctuation and articles, collapse whitespace
+    text = "".join(ch for ch in text.lower() if ch not in PUNCTUATION)
+    return " ".join(ARTICLES_RE.sub(" ", text).split())
+
+def same_claims(prediction, reference):
+    # Same negations and numbers on both sides, so a high overlap can't hide a contradiction
+    return all(
+        Counter(match.lower().replace("'", "") for match in pattern.findall(prediction))
+        == Counter(match.lower().replace("'", "") for match in pattern.findall(reference))
+        for pattern in (NEGATION_RE, NUMBER_RE)
+    )
+
+def embedding_model(embeddings):
+    # ProfiledEmbeddings passes attribute lookups on to the model it wraps
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+def cosine_thresholds(embeddings):
+    """The calibrated (cosine_correct, cosine_incorrect) for an embedding model, or None."""
+    override = os.getenv("PRE_GRADE_COSINE_THRESHOLDS")
+    if override:
+        correct, incorrect = (float(value) for value in override.split(","))
+        return correct, incorrect
+    return COSINE_THRESHOLDS.get(embedding_model(embeddings))
+
+def cosine_similarities(embeddings, texts, others):
+    # One embedding call for both lists
+    vectors = np.asarray(embeddings.embed_documents(list(texts) + list(others)))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    return np.sum(vectors[:len(texts)] * vectors[len(texts):], axis=1)
+
+def calibrate_cosine_thresholds(embeddings, predictions, references, grades, margin=0.05):
+    """
+    Thresholds for COSINE_THRESHOLDS from predictions a real LLM graded, e.g. the predicted_answer,
+    answer and result columns of a run with PRE_GRADE_EMBEDDINGS=0, where grade_source is "llm".
+
+    cosine_correct is set margin above every INCORRECT prediction and the lowest CORRECT one,
+    cosine_incorrect margin below every CORRECT prediction and the highest INCORRECT one. On
+    this data neither would have overruled the LLM, and the cosines between them, where the two
+    verdicts meet or overlap, are still left to the LLM. Calibrate on a few hundred grades, with
+    both verdicts well represented. Returns (cosine_correct, cosine_incorrect).
+    """
+    cosines = cosine_similarities(embeddings, predictions, references)
+    correct = [float(cosine) for cosine, grade in zip(cosines, grades) if grade == "CORRECT"]
+    incorrect = [float(cosine) for cosine, grade in zip(cosines, grades) if grade != "CORRECT"]
+    if not correct or not incorrect:
+        raise ValueError("calibrating cosine thresholds needs both CORRECT and INCORRECT grades")
+    cosine_correct = max(max(incorrect), min(correct)) + margin
+    cosine_incorrect = min(min(correct), max(incorrect)) - margin
+    return round(min(cosine_correct, 1.0), 3), round(max(cosine_incorrect, -1.0), 3)
+
+def token_f1(prediction, reference):
+    prediction_tokens, reference_tokens = normalise(prediction).split(), normalise(reference).split()
+    common = sum((Counter(prediction_tokens) & Counter(reference_tokens)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(prediction_tokens), common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+class PreGrader:
+    """
+    Decides the obvious grades locally, so only ambiguous predictions cost an LLM grading call.
+
+    In order: a normalised exact match is CORRECT; a refusal that shares little with the
+    reference (token-F1 below refusal_f1, and the reference isn't a refusal itself) is
+    INCORRECT; token-F1 of at least f1_correct is CORRECT. With embeddings and their
+    calibrated thresholds (see cosine_thresholds), a cosine of at least cosine_correct is
+    CORRECT, while a cosine below cosine_incorrect together with token-F1 below f1_incorrect
+    is INCORRECT. A local CORRECT also needs the same negations and numbers as the reference
+    (see same_claims). Everything else is left to the LLM.
+    """
+
+    def __init__(self, embeddings=None, f1_correct=0.8, f1_incorrect=0.1, refusal_f1=0.3, cosine_correct=None, cosine_incorrect=None):
+        # Without calibrated thresholds the cosine check is skipped
+        self.embeddings = embeddings if cosine_correct is not None and cosine_incorrect is not None else None
+        self.refusal_f1 = refusal_f1
+        self.f1_correct = f1_correct
+        self.f1_incorrect = f1_incorrect
+        self.cosine_correct = cosine_correct
+        self.cosine_incorrect = cosine_incorrect
+
+    def lexical_verdict(self, prediction, reference):
+        if normalise(prediction) == normalise(reference):
+            return "CORRECT", "exact_match"
+        f1 = token_f1(prediction, reference)
+        # A hedge tacked onto the right answer ("... I don't know.") is not a refusal
+        if REFUSAL_RE.search(prediction) and not REFUSAL_RE.search(reference) and f1 < self.refusal_f1:
+            return "INCORRECT", "refusal"
+        if f1 >= self.f1_correct and same_claims(prediction, reference):
+            return "CORRECT", "token_f1"
+        return None
+
+    def grade(self, examples, predictions):
+        """
+        Returns, in example order, {'results', 'grade_source', 'grade_time'} for each prediction
+        decided locally, or None for those that need the LLM.
+        """
+        verdicts, undecided = [], []
+        for i, (example, prediction) in enumerate(zip(examples, predictions)):
+            start = perf_counter()
+            verdict = self.lexical_verdict(prediction["result"], example["answer"])
+            verdicts.append(None if verdict is None else {"results": verdict[0], "grade_source": verdict[1], "grade_time": to_ms(perf_counter() - start)})
+            if verdict is None:
+                undecided.append(i)
+
+        if self.embeddings is not None and undecided:
+            # One embedding call for every undecided prediction and its reference
+            start = perf_counter()
+            cosines = cosine_similarities(self.embeddings, [predictions[i]["result"] for i in undecided], [examples[i]["answer"] for i in undecided])
+            share = to_ms(perf_counter() - start) / len(undecided)
+            for i, cosine in zip(undecided, cosines):
+                if cosine >= self.cosine_correct and same_claims(predictions[i]["result"], examples[i]["answer"]):
+                    verdicts[i] = {"results": "CORRECT", "grade_source": "embedding", "grade_time": share}
+                elif cosine < self.cosine_incorrect and token_f1(predictions[i]["result"], examples[i]["answer"]) < self.f1_incorrect:
+                    verdicts[i] = {"results": "INCORRECT", "grade_source": "embedding", "grade_time": share}
+        return verdicts
+
+def get_pre_grader():
+    """
+    The PreGrader for this run, or None when PRE_GRADE=0. It uses the backend's embeddings
+    for the cosine check when their thresholds are calibrated (PRE_GRADE_EMBEDDINGS=0 skips it).
+    """
+    if os.getenv("PRE_GRADE", "1") == "0":
+        return None
+    if os.getenv("PRE_GRADE_EMBEDDINGS", "1") == "0":
+        return PreGrader()
+    embeddings = get_embedding()
+    thresholds = cosine_thresholds(embeddings)
+    if thresholds is None:
+        return PreGrader()
+    return PreGrader(embeddings, cosine_correct=thresholds[0], cosine_incorrect=thresholds[1])
@@ -0,0 +1,249 @@
+import os
+import io
+import sys
+import zlib
+import pstats
+import cProfile
+import threading
+from html import escape
+from functools import wraps
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Paths through the call graph worth less than this (seconds) are left out of the flamegraph
+MIN_FRAME_TIME = 1e-5
+MAX_STACK_DEPTH = 100
+
+# From Python 3.12 cProfile hooks into sys.monitoring, which allows one active profiler per
+# process: enabling a second one, in another thread, raises ValueError
+SINGLE_PROFILER = sys.version_info >= (3, 12)
+
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        # Built-ins, e.g. "<method 'read' of '_ssl._SSLSocket' objects>"
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ",")
+
+def folded_stacks(stats, root):
+    """
+    Approximate call stacks from cProfile's caller/callee totals, in the folded format read by
+    flamegraph.pl, speedscope and inferno: "root;frame;frame <microseconds>" per line.
+
+    cProfile only keeps the time along each caller -> callee edge, so a function's own time is
+    split between its call paths in proportion to the time each path spent in it.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            # Edges are (primitive calls, calls, own time, cumulative time)
+            callees[caller][func] = edge[3]
+
+    folded = defaultdict(float)
+
+    def walk(func, stack, path, share):
+        _, _, own_time, cumulative_time, _ = stats[func]
+        scale = share / cumulative_time if cumulative_time else 0.0
+        stack = stack + [frame_label(func)]
+        folded[";".join(stack)] += own_time * scale
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees[func].items():
+            if callee in stats and callee not in path and edge_time * scale >= MIN_FRAME_TIME:
+                walk(callee, stack, path | {callee}, edge_time * scale)
+
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not any(caller in stats for caller in callers)]
+    for func in roots:
+        if stats[func][3] >= MIN_FRAME_TIME:
+            walk(func, [root], {func}, stats[func][3])
+
+    return [f"{stack} {round(time * 10**6)}" for stack, time in folded.items() if round(time * 10**6) > 0]
+
+def flamegraph_svg(lines, title="Flamegraph", width=1200, frame_height=16):
+    """Renders folded stacks as a static SVG flamegraph, roots at the bottom; hover a frame for its time."""
+    tree = {"children": {}, "value": 0}
+    for line in lines:
+        stack, value = line.rsplit(" ", 1)
+        node = tree
+        node["value"] += int(value)
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"children": {}, "value": 0})
+            node["value"] += int(value)
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    levels = depth(tree) - 1
+    height = (levels + 2) * frame_height
+    rects = []
+
+    def layout(name, node, x, level):
+        frame_width = node["value"] / tree["value"] * width if tree["value"] else 0
+        if frame_width < 0.5:
+            return
+        y = height - (level + 1) * frame_height
+        hue = zlib.crc32(name.encode("utf-8")) % 60
+        # About 6.5px per character at font-size 11
+        if len(name) * 6.5 < frame_width:
+            label = name
+        elif frame_width > 30:
+            label = name[:int(frame_width / 6.5) - 2] + ".."
+        else:
+            label = ""
+        rects.append(
+            f'<g><title>{escape(name)} ({node["value"] / 10**3:.3f} ms, {node["value"] / tree["value"] * 100:.2f}%)</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{frame_width:.2f}" height="{frame_height - 1}" fill="hsl({hue}, 85%, 60%)"/>'
+            f'<text x="{x + 3:.2f}" y="{y + frame_height - 4}">{escape(label)}</text></g>'
+        )
+        for child_name, child in node["children"].items():
+            layout(child_name, child, x, level + 1)
+            x += child["value"] / tree["value"] * width
+
+    x = 0.0
+    for name, node in tree["children"].items():
+        layout(name, node, x, 0)
+        x += node["value"] / tree["value"] * width
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">'
+        f'<text x="{width / 2}" y="{frame_height - 4}" text-anchor="middle" font-size="13">{escape(title)}</text>'
+        + "".join(rects) + "</svg>\n"
+    )
+
+class PhaseProfiler:
+    """
+    cProfile per pipeline phase (CSV load, vector DB open, embedding, retrieval, chain, grading, ...).
+
+    Phases nest and are exclusive: entering one pauses the phase around it in that thread,
+    so each phase's stats hold only its own work. cProfile sees a single thread, so work
+    handed to a thread pool is only profiled if wrapped with profiled(), which runs it in
+    the submitting thread's phase. Every entry of a phase, in any thread, is merged into
+    that phase's stats on dump().
+
+    Where only one profiler can be active per process (SINGLE_PROFILER, Python 3.12+), one
+    thread at a time is profiled: phases entered in other threads meanwhile run unprofiled,
+    and are counted and reported rather than failing.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._profiles = defaultdict(list)
+        self._unprofiled = defaultdict(int)
+        self._owner = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_phase(self):
+        stack = self._stack()
+        return stack[-1][0] if stack else None
+
+    def _claim(self):
+        # Whether this thread may start profiling: always, unless another thread holds the one profiler
+        if not SINGLE_PROFILER:
+            return True
+        with self._lock:
+            if self._owner is None:
+                self._owner = threading.get_ident()
+            if self._owner != threading.get_ident():
+                return False
+        return True
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._stack()
+        if stack and stack[-1][0] == name:
+            # Already in this phase, e.g. a retriever called from a retriever
+            yield
+            return
+        if not stack and not self._claim():
+            with self._lock:
+                if not self._unprofiled:
+                    print(f"Profiling one thread at a time on Python {sys.version_info[0]}.{sys.version_info[1]}: "
+                          f"phases in other threads run unprofiled meanwhile")
+                self._unprofiled[name] += 1
+            yield
+            return
+        if stack:
+            stack[-1][1].disable()
+        profile = cProfile.Profile()
+        stack.append((name, profile))
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            stack.pop()
+            with self._lock:
+                self._profiles[name].append(profile)
+            if stack:
+                stack[-1][1].enable()
+            elif SINGLE_PROFILER:
+                with self._lock:
+                    self._owner = None
+
+    def dump(self):
+        """
+        Writes, per phase, <phase>.prof (pstats, for snakeviz or pstats.Stats) and <phase>.txt
+        (the top functions by own and cumulative time), then every phase's folded stacks to
+        profile.folded and their flamegraph to flamegraph.svg. Returns the directory.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        with self._lock:
+            profiles = {name: list(entries) for name, entries in self._profiles.items()}
+            unprofiled = dict(self._unprofiled)
+        if unprofiled:
+            print(f"Phase entries left unprofiled while another thread was profiled: {unprofiled}")
+        folded = []
+        for name, entries in profiles.items():
+            stats = pstats.Stats(*entries)
+            stats.dump_stats(os.path.join(self.out_dir, f"{name}.prof"))
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats("tottime").print_stats(30)
+            stats.sort_stats("cumulative").print_stats(30)
+            with open(os.path.join(self.out_dir, f"{name}.txt"), "w", encoding="utf-8") as file:
+                file.write(report.getvalue())
+            folded.extend(folded_stacks(stats.stats, name))
+
+        with open(os.path.join(self.out_dir, "profile.folded"), "w", encoding="utf-8") as file:
+            file.write("\n".join(folded) + "\n")
+        with open(os.path.join(self.out_dir, "flamegraph.svg"), "w", encoding="utf-8") as file:
+            file.write(flamegraph_svg(folded, title=f"Client-side time by phase: {', '.join(profiles)}"))
+        return self.out_dir
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def get_profiler():
+    """Returns the process-wide PhaseProfiler writing to PROFILE_DIR, or None when PROFILE_DIR is not set."""
+    global _profiler
+    out_dir = os.getenv("PROFILE_DIR")
+    if not out_dir:
+        return None
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = PhaseProfiler(out_dir)
+    return _profiler
+
+def profile_phase(name):
+    """Context manager profiling its body as the named phase; does nothing unless profiling."""
+    profiler = get_profiler()
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+def profiled(fn):
+    """Wraps fn, about to be handed to a thread pool, to run in the calling thread's current phase."""
+    profiler = get_profiler()
+    phase = profiler.current_phase() if profiler is not None else None
+    if phase is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        with profiler.phase(phase):
+            return fn(*args, **kwargs)
+    return run
@@ -1,8 +1,7 @@
-from datetime import datetime
-from langchain.chains import RetrievalQA
-from langchain.callbacks import get_openai_callback
-from modules.results_data import ResultsData
+from time import perf_counter
+from modules.chains import build_qa
 from modules.evaluation import add_to_results_list
+from modules.instrumentation import LatencyCallbackHandler, to_ms
 
 def qa_analysis(llm, chain_type, retriever, verbose, query, number, results_data):
     """
@@ -10,35 +9,31 @@ def qa_analysis(llm, chain_type, retriever, verbose, query, number, results_data
     Then, it runs the QA analysis, timing its execution and printing the response along with the execution time.
     """
     # Initialize the RetrievalQA object with the specified parameters.
-    qa = RetrievalQA.from_chain_type(
-        llm=llm, 
-        chain_type=chain_type, 
-        retriever=retriever, 
-        verbose=verbose
-    )
-
-    # Measure number of tokens used
-    with get_openai_callback() as cb:
-        start = datetime.now()
-
-        try:
-            # Execute the QA analysis
-            response = qa.invoke(query) #TODO: i've only added queries, no answers...
-        except ValueError as e: 
-            response = e
-
-        end = datetime.now()
-    
-    tokens_used = cb.total_tokens
+    qa = build_qa(llm, chain_type, retriever, verbose)
+
+    # Measure time and number of tokens used for every LLM call
+    handler = LatencyCallbackHandler()
+    start = perf_counter()
+
+    try:
+        # Execute the QA analysis
+        response = qa.invoke(query, config={"callbacks": [handler]}) #TODO: i've only added queries, no answers...
+    except ValueError as e: 
+        response = e
+
+    end = perf_counter()
+    summary = handler.summary(start)
+    tokens_used = summary["prompt_tokens"] + summary["completion_tokens"]
 
-    # Calculate the difference between the end and start timestamps to get the execution duration.
     # The duration is converted to milliseconds for a more precise and readable format.
-    td = (end - start).total_seconds() * 10**3
+    td = to_ms(end - start)
     
     print(f"Response: {response}\nThe time of execution of above program is : {td:.03f}ms")
 
-    results_data = add_to_results_list(results_data, chain_type, query, td, tokens_used, number, response)
+    results_data = add_to_results_list(results_data, chain_type, query, td, tokens_used, number, response, 
+                                       ttft=summary["ttft"], prompt_tokens=summary["prompt_tokens"], 
+                                       completion_tokens=summary["completion_tokens"], llm_calls=summary["llm_calls"])
 
-    print("\n\nTESTING\n:" + '\n'.join([str(item) for item in results_data]))
+    print("\n\nTESTING\n:" + results_data.to_frame().to_string())
 
     return results_data
@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import get_buffer_string
+from modules.tokens import count_tokens
+
+# Completion tokens reserved against the tokens-per-minute limit when the model sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding up to `capacity` units, refilled at capacity per minute.
+    A request larger than the capacity waits for a full bucket and then overdraws it.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Seconds until `amount` (capped at capacity) is available
+        needed = min(amount, self.capacity) - self.available
+        return max(needed, 0) * 60.0 / self.capacity
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits shared by every thread making LLM calls.
+    Either limit may be None to leave it unbounded.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        """Blocks until one request of `tokens` tokens fits within both limits, then takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                buckets = [(b, n) for b, n in ((self.requests, 1), (self.tokens, tokens)) if b is not None]
+                for bucket, _ in buckets:
+                    bucket.refill(now)
+                wait = max((bucket.wait_time(n) for bucket, n in buckets), default=0)
+                if wait == 0:
+                    for bucket, n in buckets:
+                        bucket.available -= n
+                    return
+            time.sleep(wait)
+
+    def refund(self, tokens=0):
+        """Gives back a request of `tokens` tokens that never reached the API."""
+        with self._lock:
+            for bucket, n in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.available = min(bucket.capacity, bucket.available + n)
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """
+    Charges every call of the model it is attached to (see backend.get_llm) to a RateLimiter
+    before the request goes out: one request, and the prompt's tokens plus the completion's
+    max_tokens. Answering, grading and Q&A generation calls are all charged, whichever chain
+    makes them. A response served from the cache never reached the API, so it is refunded.
+    """
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self._charged = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._charge(run_id, "".join(prompts), kwargs.get("invocation_params") or {})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._charge(run_id, "".join(get_buffer_string(message_list) for message_list in messages), kwargs.get("invocation_params") or {})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            tokens = self._charged.pop(run_id, None)
+        # Responses served from the cache come back without any llm_output
+        if tokens is not None and response.llm_output is None:
+            self.rate_limiter.refund(tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._charged.pop(run_id, None)
+
+    def _charge(self, run_id, text, params):
+        model = params.get("model_name") or params.get("model")
+        tokens = count_tokens(text, model) + (params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+        self.rate_limiter.acquire(tokens)
+        with self._lock:
+            self._charged[run_id] = tokens
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter configured by RATE_LIMIT_RPM and RATE_LIMIT_TPM,
+    or None when neither is set. get_llm attaches it to every chat model it returns.
+    """
+    global _rate_limiter
+    rpm, tpm = os.getenv("RATE_LIMIT_RPM"), os.getenv("RATE_LIMIT_TPM")
+    if not rpm and not tpm:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(float(rpm) if rpm else None, float(tpm) if tpm else None)
+    return _rate_limiter
@@ -1,18 +1,171 @@
-class ResultsData:
-    def __init__(self, chain_type, time=None, tokens_used=None, example_number=None, predicted_query=None, predicted_answer=None, answer=None, result=None):
-        self.chain_type = chain_type
-        self.eval = []
-        if example_number is not None:
-            self.append_evaluation(time, tokens_used, example_number, predicted_query, answer, predicted_answer, result)
-    
-    def append_evaluation(self, time, tokens_used, example_number, predicted_query, answer, predicted_answer, result):
-        """Append a new evaluation result to the eval list."""
-        self.eval.append({
-            "time": time,
-            "tokens_used": tokens_used,
-            "example_number": example_number,
-            "query": predicted_query,
-            "predicted_answer": predicted_answer,
-            "answer": answer,
-            "result": result
-        })
+import os
+
+# Resamples drawn for the bootstrap confidence intervals
+BOOTSTRAP_SAMPLES = 2000
+
+# One row per evaluated example. Times are in ms; the estimated_* columns are the pre-flight
+# predictions (see modules.cost_estimator) and routed_to the chain type actually run when an
+# over-budget question was rerouted. grade_source says what decided the result: "llm", or a
+# local check ("exact_match", "refusal", "token_f1", "embedding"; see modules.pre_grading), or
+# "rejected" for an over-budget question that was never run (result "REJECTED", no times or tokens).
+SCHEMA = {
+    "chain_type": "category",
+    "example_number": "Int64",
+    "trial": "Int64",
+    "query": "string",
+    "predicted_answer": "string",
+    "answer": "string",
+    "result": "string",
+    "grade_source": "string",
+    "time": "Float64",
+    "queue_time": "Float64",
+    "ttft": "Float64",
+    "grade_time": "Float64",
+    "tokens_used": "Int64",
+    "prompt_tokens": "Int64",
+    "completion_tokens": "Int64",
+    "llm_calls": "Int64",
+    "estimated_tokens": "Int64",
+    "estimated_calls": "Int64",
+    "estimated_time": "Float64",
+    "routed_to": "string",
+}
+
+# One row per underlying LLM call (see modules.instrumentation), keyed by the example's row
+CALL_SCHEMA = {
+    "row": "Int64",
+    "start": "Float64",
+    "end": "Float64",
+    "time": "Float64",
+    "queue_time": "Float64",
+    "ttft": "Float64",
+    "prompt_tokens": "Int64",
+    "completion_tokens": "Int64",
+    "error": "string",
+}
+
+def calls_path_gen(path):
+    # e.g. results/results.parquet -> results/results.calls.parquet
+    return os.path.splitext(path)[0] + ".calls" + os.path.splitext(path)[1]
+
+class ResultsStore:
+    """
+    Append-optimised columnar store of evaluation results, for every chain type at once.
+
+    Each column is a list, so append is O(1) whatever the size of the run. to_frame() turns
+    the columns into a DataFrame with typed (nullable) columns, built once and reused until
+    the next append, for vectorised filtering and group-by. The per-call spans live in a
+    second table. Both persist as Parquet. Appending needs neither pandas nor NumPy, so they
+    are only imported once a frame is asked for.
+    """
+
+    def __init__(self):
+        self._columns = {name: [] for name in SCHEMA}
+        self._calls = {name: [] for name in CALL_SCHEMA}
+        self._frame = None
+        self._calls_frame = None
+
+    def __len__(self):
+        return len(self._columns["chain_type"])
+
+    def append(self, chain_type, llm_calls=None, **fields):
+        """
+        Appends one example's results. Fields are the SCHEMA columns; llm_calls is the list of
+        span dicts from LatencyCallbackHandler, stored as a count here and the spans in the calls table.
+        """
+        unknown = set(fields) - set(SCHEMA)
+        if unknown:
+            raise TypeError(f"Unknown result fields: {', '.join(sorted(unknown))}")
+        row = len(self)
+        spans = llm_calls or []
+        for name, values in self._columns.items():
+            values.append(fields.get(name))
+        self._columns["chain_type"][row] = chain_type
+        self._columns["llm_calls"][row] = len(spans)
+        for span in spans:
+            for name, values in self._calls.items():
+                values.append(row if name == "row" else span.get(name))
+        self._frame = self._calls_frame = None
+        return self
+
+    def extend(self, other):
+        """Appends every row of another ResultsStore, e.g. one strategy's results."""
+        offset = len(self)
+        for name, values in self._columns.items():
+            values.extend(other._columns[name])
+        for name, values in self._calls.items():
+            values.extend([row + offset for row in other._calls[name]] if name == "row" else other._calls[name])
+        self._frame = self._calls_frame = None
+        return self
+
+    def to_frame(self):
+        """The results as a typed DataFrame, one row per example, in insertion order."""
+        if self._frame is None:
+            import pandas as pd
+            self._frame = pd.DataFrame(self._columns).astype(SCHEMA)
+        return self._frame
+
+    def calls_frame(self):
+        """The LLM call spans as a typed DataFrame; 'row' is the example's row in to_frame()."""
+        if self._calls_frame is None:
+            import pandas as pd
+            self._calls_frame = pd.DataFrame(self._calls).astype(CALL_SCHEMA)
+        return self._calls_frame
+
+    def chain_types(self):
+        # In order of first appearance
+        return list(dict.fromkeys(self._columns["chain_type"]))
+
+    def summary(self):
+        """Per chain type: mean eval time and tokens, and correctness ratio (%), in one group-by."""
+        df = self.to_frame()
+        return df.assign(is_correct=(df["result"] == "CORRECT").astype(float) * 100).groupby(
+            "chain_type", observed=True, sort=False
+        ).agg(eval_time=("time", "mean"), tokens_used=("tokens_used", "mean"), is_correct=("is_correct", "mean")).reset_index()
+
+    def latency_summary(self, confidence=0.95, seed=0):
+        """
+        Per chain type, over every trial: sample count, p50/p90/p99 eval time, mean eval time
+        with its bootstrap confidence interval, and token mean, standard deviation and
+        coefficient of variation.
+        """
+        import numpy as np
+        import pandas as pd
+        df = self.to_frame()
+        rng = np.random.default_rng(seed)
+        rows = []
+        for chain_type, group in df.groupby("chain_type", observed=True, sort=False):
+            times = group["time"].dropna().to_numpy(dtype=float)
+            tokens = group["tokens_used"].dropna().to_numpy(dtype=float)
+            row = {"chain_type": chain_type, "trials": group["trial"].nunique(), "samples": len(times)}
+            if len(times):
+                # Means of resamples with replacement, all drawn in one array
+                means = times[rng.integers(0, len(times), (BOOTSTRAP_SAMPLES, len(times)))].mean(axis=1)
+                tail = (1 - confidence) / 2 * 100
+                row.update(
+                    mean=times.mean(), ci_low=np.percentile(means, tail), ci_high=np.percentile(means, 100 - tail),
+                    p50=np.percentile(times, 50), p90=np.percentile(times, 90), p99=np.percentile(times, 99),
+                )
+            if len(tokens):
+                row.update(tokens_mean=tokens.mean(), tokens_std=tokens.std(ddof=1) if len(tokens) > 1 else 0.0)
+                row["tokens_cv"] = row["tokens_std"] / row["tokens_mean"] if row["tokens_mean"] else None
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def save(self, path):
+        """Writes the results to path and the call spans alongside, as Parquet."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.to_frame().to_parquet(path, index=False)
+        self.calls_frame().to_parquet(calls_path_gen(path), index=False)
+
+    @classmethod
+    def load(cls, path):
+        import pandas as pd
+        store = cls()
+        frame = pd.read_parquet(path)
+        store._columns = {name: frame[name].astype(object).where(frame[name].notna(), None).tolist() for name in SCHEMA}
+        calls_path = calls_path_gen(path)
+        if os.path.exists(calls_path):
+            calls = pd.read_parquet(calls_path)
+            store._calls = {name: calls[name].astype(object).where(calls[name].notna(), None).tolist() for name in CALL_SCHEMA}
+        return store
@@ -0,0 +1,87 @@
+import os
+import json
+import threading
+from datetime import datetime
+from modules.eval_set_store import text_hash
+
+def cell_key(chain_type, example, trial=0):
+    # One cell per (strategy, example, trial); the example is identified by its question and reference answer
+    key = f"{chain_type}:{text_hash(example['query'] + chr(10) + example.get('answer', ''))}"
+    return f"{key}#{trial}" if trial else key
+
+class RunJournal:
+    """
+    Append-only JSONL journal of a run, so a crashed run can resume where it stopped.
+
+    Every (strategy, example, trial) cell gets a line as soon as its prediction completes and
+    another once it is graded; each line is flushed and fsynced before the run moves on. On opening,
+    the lines are merged per cell, so later lines add to (or override) earlier ones.
+    A torn last line from a crash is ignored.
+
+    Without a path the journal lives in memory, e.g. in a worker process: cells can be seeded
+    from the real journal, and the new lines are kept in records for the parent to merge(),
+    or, given a queue, put on it as they are written for the parent to merge() as they come.
+    """
+
+    def __init__(self, path=None, cells=None, queue=None):
+        self.path = path
+        self.queue = queue
+        self._lock = threading.Lock()
+        self._cells = {key: dict(fields) for key, fields in (cells or {}).items()}
+        self.records = []
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._cells.setdefault(record.pop("key"), {}).update(record)
+        if path and self._cells:
+            print(f"Resuming run from {path}: {len(self._cells)} cells journalled")
+
+    def get(self, chain_type, example, trial=0):
+        """Everything journalled for a cell so far, or None."""
+        return self._cells.get(cell_key(chain_type, example, trial))
+
+    def record(self, chain_type, example, trial=0, **fields):
+        self.merge([{"key": cell_key(chain_type, example, trial), "chain_type": chain_type, **fields}])
+
+    def merge(self, records):
+        """Journals records (as kept by an in-memory journal) with a single write and fsync."""
+        if not records:
+            return
+        with self._lock:
+            if self.path is None and self.queue is not None:
+                self.queue.put(records)
+            elif self.path is None:
+                self.records.extend(records)
+            else:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+                    file.flush()
+                    os.fsync(file.fileno())
+            for record in records:
+                self._cells.setdefault(record["key"], {}).update({k: v for k, v in record.items() if k not in ("key", "chain_type")})
+
+    def cells(self, chain_type, examples, trials=1):
+        """Everything journalled for these cells, to seed an in-memory journal with."""
+        keys = (cell_key(chain_type, example, trial) for example in examples for trial in range(trials))
+        return {key: dict(self._cells[key]) for key in keys if key in self._cells}
+
+    def is_complete(self, chain_type, examples, trials=1):
+        """Whether every example of a strategy has been predicted and graded, in every trial."""
+        return all("result" in (self.get(chain_type, example, trial) or {}) for example in examples for trial in range(trials))
+
+    def archive(self):
+        """
+        Moves the journal of a finished run aside (timestamped), so the next run starts afresh.
+        Returns the new path, or None if nothing was journalled.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        stem, ext = os.path.splitext(self.path)
+        archived = f"{stem}.{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        os.replace(self.path, archived)
+        return archived
@@ -0,0 +1,88 @@
+import os
+import threading
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from modules.evaluation import generate_examples, generate_qas, evaluate, apply_concurrently
+from modules.results_data import ResultsStore
+
+def without_cache(llm):
+    # A copy of the chat model that bypasses the response cache
+    fields = {name: getattr(llm, name) for name in type(llm).__fields__ if name != "callback_manager"}
+    return type(llm)(**{**fields, "cache": False})
+
+def measured_llm(llm):
+    """
+    The chat model for the measured answering and grading calls: one that bypasses the response
+    cache, since a hit costs no tokens and next to no time. LLM_CACHE_MEASURED=1 keeps the cache
+    for development runs, whose latencies and token counts then mean nothing.
+    """
+    if os.getenv("LLM_CACHE_MEASURED", "0") == "1":
+        return llm
+    return without_cache(llm)
+
+def run_strategy(chain_type, file_path, db, llm, limiter=None, examples=None, retriever=None, journal=None, trials=1, warmups=0,
+                 warm_up=True, example_offset=0, max_concurrency=None):
+    """
+    Builds the QA chain for a single chain type and evaluates it on the given Q&As,
+    trials times, after warmups untimed passes whose results are discarded.
+    For a shard of the Q&As, example_offset is the number of its first example and
+    warm_up=False skips the single warm-up query when another shard already ran it.
+    max_concurrency is the limiter's size, which bounds the threads running the examples.
+    Returns a fresh ResultsStore holding only this strategy's results.
+    """
+    qa, examples = generate_qas(file_path, db, llm, chain_type, limiter, examples, retriever, journal, trials, warm_up)
+    if journal is None or not journal.is_complete(chain_type, examples, trials):
+        for _ in range(warmups):
+            apply_concurrently(qa, examples, limiter, max_concurrency=max_concurrency)
+
+    results_data = ResultsStore()
+    for trial in range(trials):
+        results_data = evaluate(chain_type, qa, examples, llm, results_data, limiter, journal, trial, example_offset, max_concurrency)
+    return results_data
+
+def run_strategies(strategies, file_path, db, llm, results_data, max_concurrency=4, journal=None, trials=1, warmups=0):
+    """
+    Runs every strategy in its own thread, with the examples of each strategy also run in parallel.
+
+    Parameters:
+    - strategies: The chain types to evaluate, e.g. ["stuff", "map_reduce"].
+    - file_path: Path to the catalog CSV used to generate the Q&As.
+    - db: The vector db backing the retriever.
+    - llm: The chat model used for answering and grading; the response cache is bypassed (see measured_llm).
+    - results_data: The ResultsStore to extend.
+    - max_concurrency: Global cap on LLM calls in flight across all strategies.
+    - journal: Optional RunJournal; results are journalled as they complete and cells it
+      already holds (from a run that crashed) are not run again.
+    - trials: Times every example is run per strategy, for latency percentiles and intervals.
+    - warmups: Passes over the examples per strategy run first and discarded.
+
+    Returns:
+    - results_data extended with each strategy's results, in the order of strategies.
+    """
+    from modules.batch_retrieval import PrefetchedRetriever
+    from modules.instrumentation import to_ms
+    from modules.metrics import observe_retrieval, ALL_STRATEGIES
+
+    llm = measured_llm(llm)
+
+    # One semaphore shared by every strategy so the global limit holds
+    limiter = threading.BoundedSemaphore(max_concurrency)
+
+    # Every strategy is graded on the same evaluation set, generated (at most) once
+    examples = generate_examples(file_path, limiter)
+
+    # Retrieval doesn't depend on the strategy: embed and search all queries once, in one batch
+    start = perf_counter()
+    retriever = PrefetchedRetriever.from_queries(db, [example["query"] for example in examples])
+    retrieval_time = to_ms(perf_counter() - start)
+    observe_retrieval(ALL_STRATEGIES, retrieval_time, len(retriever.documents))
+    print(f"Retrieved documents for {len(examples)} queries in {retrieval_time:.03f}ms")
+
+    with ThreadPoolExecutor(max_workers=len(strategies)) as pool:
+        futures = [pool.submit(run_strategy, strat, file_path, db, llm, limiter, examples, retriever, journal, trials, warmups,
+                               max_concurrency=max_concurrency) for strat in strategies]
+        # Each strategy keeps its own results so timings never mix
+        for future in futures:
+            results_data.extend(future.result())
+
+    return results_data
@@ -0,0 +1,161 @@
+import os
+import threading
+import multiprocessing
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from modules.evaluation import generate_examples
+from modules.metrics import observe_prediction, observe_grade, observe_retrieval, ALL_STRATEGIES
+from modules.run_journal import RunJournal
+from modules.runner import run_strategy, measured_llm
+
+# A spawned worker imports this module before anything else; the model, vector store and
+# retrieval modules are imported once it is set up, so import_benchmark.py times its cold start
+
+# Examples per shard: enough to keep a worker's calls in flight, few enough to balance the
+# workers and to lose little when a run dies with shards in progress
+DEFAULT_SHARD_SIZE = 50
+
+# Per worker process, set up once by init_worker
+_worker = {}
+
+def init_worker(limiter, records, db_path, processes):
+    from modules.backend import get_llm, get_embedding
+    from modules.numpy_store import NumpyVectorStore
+    # Rate limiters are per process, so each worker gets an equal share of the limits
+    for name in ("RATE_LIMIT_RPM", "RATE_LIMIT_TPM"):
+        if os.getenv(name):
+            os.environ[name] = str(float(os.environ[name]) / processes)
+    _worker.update(
+        limiter=limiter,
+        records=records,
+        # Bypasses the response cache, or each worker's warm-up query would make a hit of an example
+        llm=measured_llm(get_llm(temperature = 0.0)),
+        # Memory-mapped, so every worker searches the one copy of the index in the page cache
+        db=NumpyVectorStore(get_embedding(), persist_directory=db_path) if db_path else None,
+        warmed=set(),
+    )
+
+def evaluate_shard(shard):
+    """
+    Evaluates one strategy on one shard of the Q&As, in a worker process, putting each
+    journal line on the records queue as it is written. Returns the shard's ResultsStore
+    and the ms its batch retrieval took (None when the documents came with the shard).
+    """
+    from modules.batch_retrieval import PrefetchedRetriever
+    from modules.instrumentation import to_ms
+
+    chain_type, examples = shard["chain_type"], shard["examples"]
+    retrieval_time = None
+    if shard["documents"] is not None:
+        retriever = PrefetchedRetriever(documents=shard["documents"])
+    else:
+        # One batched search of the shared index for the whole shard
+        start = perf_counter()
+        retriever = PrefetchedRetriever.from_queries(_worker["db"], [example["query"] for example in examples])
+        retrieval_time = to_ms(perf_counter() - start)
+
+    # Seeded with what the run journal already holds for these cells, so a resumed run skips them
+    journal = RunJournal(cells=shard["cells"], queue=_worker["records"])
+    warm_up = chain_type not in _worker["warmed"]
+    _worker["warmed"].add(chain_type)
+    results = run_strategy(chain_type, shard["file_path"], _worker["db"], _worker["llm"], _worker["limiter"], examples, retriever,
+                           journal, shard["trials"], shard["warmups"], warm_up, shard["offset"], shard["max_concurrency"])
+    return results, retrieval_time
+
+def observe_records(records):
+    # Worker metrics stay in the workers; the parent's come from the journalled results
+    for record in records:
+        if "measurement" in record:
+            observe_prediction(record["chain_type"], record["measurement"])
+        if "result" in record:
+            observe_grade(record["chain_type"], record.get("grade_time"), record.get("grade_source"), record.get("grade_calls"))
+
+def drain_records(records, journal):
+    # Journals the workers' lines as they arrive, until the None put after the pool shut down
+    for batch in iter(records.get, None):
+        if journal is not None:
+            journal.merge(batch)
+        observe_records(batch)
+
+def run_sharded(strategies, file_path, db, results_data, max_concurrency=4, journal=None, trials=1, warmups=0, processes=None, shard_size=None):
+    """
+    Evaluates every strategy like run_strategies, with the (strategy, example) grid split into
+    shards that run in a pool of worker processes, so local work (prompt rendering, parsing,
+    local grading, similarity search) isn't bound to one core.
+
+    Workers build their own chat model from the environment and share one semaphore, so
+    max_concurrency still caps the LLM calls in flight across all of them. A NumPy vector db
+    (VECTOR_STORE=numpy) is memory-mapped by every worker from its persist_directory rather
+    than copied; for any other store the documents for every query are retrieved here, once,
+    and shipped with the shards. Journal lines stream back from the workers as they are
+    written, so a crash loses no finished result. Metrics and per-phase profiles of the
+    workers are not collected, but the metrics of their results and retrievals are.
+
+    Parameters:
+    - strategies, file_path, db, results_data, max_concurrency, journal, trials, warmups: As for run_strategies.
+    - processes: Worker processes (default: one per CPU).
+    - shard_size: Examples per shard (default SHARD_SIZE, or 50).
+
+    Returns:
+    - results_data extended with every shard's results, in the order of strategies and examples.
+    """
+    from modules.batch_retrieval import PrefetchedRetriever
+    from modules.instrumentation import to_ms
+    from modules.numpy_store import NumpyVectorStore
+
+    processes = processes or os.cpu_count()
+    shard_size = shard_size or int(os.getenv("SHARD_SIZE", DEFAULT_SHARD_SIZE))
+    # Spawned rather than forked: the parent already runs threads (metrics, vector store clients)
+    context = multiprocessing.get_context("spawn")
+    limiter = context.BoundedSemaphore(max_concurrency)
+
+    # Every strategy is graded on the same evaluation set, generated (at most) once
+    examples = generate_examples(file_path, limiter)
+
+    db_path = None
+    documents = None
+    if isinstance(db, NumpyVectorStore) and db.persist_directory and os.path.exists(os.path.join(db.persist_directory, "vectors.npy")):
+        db_path = db.persist_directory
+    else:
+        start = perf_counter()
+        documents = PrefetchedRetriever.from_queries(db, [example["query"] for example in examples]).documents
+        retrieval_time = to_ms(perf_counter() - start)
+        observe_retrieval(ALL_STRATEGIES, retrieval_time, len(documents))
+        print(f"Retrieved documents for {len(examples)} queries in {retrieval_time:.03f}ms, to ship with the shards")
+
+    shards = []
+    for chain_type in strategies:
+        for offset in range(0, len(examples), shard_size):
+            chunk = examples[offset:offset + shard_size]
+            shards.append({
+                "chain_type": chain_type,
+                "file_path": file_path,
+                "examples": chunk,
+                "offset": offset,
+                "trials": trials,
+                "warmups": warmups,
+                "max_concurrency": max_concurrency,
+                "documents": None if documents is None else {example["query"]: documents[example["query"]] for example in chunk},
+                "cells": journal.cells(chain_type, chunk, trials) if journal is not None else {},
+            })
+
+    start = perf_counter()
+    workers = max(min(processes, len(shards)), 1)
+    records = context.Queue()
+    drain = threading.Thread(target=drain_records, args=(records, journal), daemon=True)
+    drain.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(limiter, records, db_path, workers)) as pool:
+            futures = [pool.submit(evaluate_shard, shard) for shard in shards]
+            for shard, future in zip(shards, futures):
+                results, retrieval_time = future.result()
+                if retrieval_time is not None:
+                    observe_retrieval(shard["chain_type"], retrieval_time, len(shard["examples"]))
+                results_data.extend(results)
+    finally:
+        # The workers have exited, so everything they put is ahead of this
+        records.put(None)
+        drain.join()
+    print(f"Evaluated {len(shards)} shards on {workers} processes in {to_ms(perf_counter() - start):.03f}ms")
+
+    return results_data
@@ -0,0 +1,100 @@
+import os
+import csv
+import random
+from modules.catalog import CatalogReader
+
+# Vocabulary for products in the OutdoorClothingCatalog style
+AUDIENCES = ["Women's", "Men's", "Kids'", "Infant and Toddler", "Unisex", "Girls'", "Boys'"]
+LINES = ["Campside", "Trailblazer", "Coastal Chill", "EcoFlex", "Summit", "Ridgeline", "Harbor", "Everyday", "Storm", "Backcountry", "Lakeshore", "Sunrise"]
+PRODUCTS = ["Oxfords", "Rain Jacket", "Hiking Boots", "Swimsuit", "Fleece Pullover", "Storm Pants", "Tee", "Dog Mat", "Backpack", "Sun Shirt", "Down Vest", "Trail Runners", "Tankini", "Beanie", "Parka"]
+VARIANTS = ["Relaxed Fit", "Slim Fit", "Two-Piece", "Short-Sleeve", "Long-Sleeve", "Chevron Weave", "Insulated", "Waterproof", "V-Neck", "Crewneck"]
+MATERIALS = ["recycled polyester", "organic cotton", "merino wool", "nylon ripstop", "soft canvas", "TEK O2 membrane", "Gore-Tex", "bamboo viscose", "PrimaLoft insulation", "spandex blend"]
+FEATURES = ["UPF 50+ sun protection", "moisture-wicking fabric", "a waterproof, breathable shell", "reinforced seams", "odor control", "zippered pockets", "an adjustable hood", "quick-drying fabric", "cushioned footbeds", "packable construction"]
+USES = ["hiking", "paddling", "camping", "running", "travel", "beach days", "snowshoeing", "everyday wear", "trail running", "fishing"]
+SECTIONS = ["Size & Fit", "Specs", "Construction", "Fabric & Care", "Additional Features", "Why We Love It"]
+
+def product_name(rng):
+    return f"{rng.choice(AUDIENCES)} {rng.choice(LINES)} {rng.choice(PRODUCTS)}, {rng.choice(VARIANTS)}"
+
+def sentence(rng):
+    templates = [
+        "Made of {material} with {feature}, it is built for {use}.",
+        "{feature_cap} keeps you comfortable on {use} trips.",
+        "Our {material} gives {feature} without extra weight.",
+        "Designed for {use}, with {feature} and {feature2}.",
+        "Approx. weight: {ounces} oz.",
+        "Machine wash and dry; imported.",
+    ]
+    feature = rng.choice(FEATURES)
+    return rng.choice(templates).format(
+        material=rng.choice(MATERIALS), feature=feature, feature_cap=feature[0].upper() + feature[1:],
+        feature2=rng.choice(FEATURES), use=rng.choice(USES), ounces=rng.randint(3, 40),
+    )
+
+def description(rng, words):
+    # Sentences under the catalog's section headings until the target length in words is reached
+    parts, count = [], 0
+    while count < words:
+        text = sentence(rng)
+        if parts and rng.random() < 0.2:
+            text = f"\n\n{rng.choice(SECTIONS)}: {text}"
+        parts.append(text)
+        count += len(text.split())
+    return " ".join(parts)
+
+def synthetic_filename_gen(data_dir, rows, description_words):
+    # e.g. data/synthetic/SyntheticCatalog_100000_60w.csv
+    return os.path.join(data_dir, f"SyntheticCatalog_{rows}_{description_words}w.csv")
+
+def generate_catalog(data_dir, rows, description_words=60, seed=0):
+    """
+    Writes a synthetic catalog CSV in the OutdoorClothingCatalog schema (index, name, description),
+    streamed row by row so a million rows needs no more memory than one.
+    The same arguments always give the same file, which is only written if missing.
+    Returns the file path.
+    """
+    file_path = synthetic_filename_gen(data_dir, rows, description_words)
+    if os.path.exists(file_path):
+        return file_path
+
+    os.makedirs(data_dir, exist_ok=True)
+    rng = random.Random(seed)
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["", "name", "description"])
+        for row in range(rows):
+            writer.writerow([row, product_name(rng), description(rng, description_words)])
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def generate_queries(file_path, count, complexity=1, seed=0):
+    """
+    Questions about products picked at random from a catalog, at increasing complexity:
+    1 asks about one product, 2 compares two, 3 asks for several suggestions formatted as a
+    markdown table with a summary, like the manual queries in main.py.
+    """
+    catalog = CatalogReader(file_path)
+    rng = random.Random(seed)
+
+    def name():
+        # page_content holds one "column: value" line per column; the first is the unnamed index
+        document = catalog[rng.randrange(len(catalog))]
+        for line in document.page_content.split("\n"):
+            value = line[len("name: "):].strip() if line.startswith("name: ") else ""
+            # A product name has words; a bare number means the index column leaked in
+            if any(ch.isalpha() for ch in value):
+                return value
+        raise ValueError(f"Row {document.metadata['row']} of {file_path} has no product name to ask about")
+
+    queries = []
+    for _ in range(count):
+        if complexity <= 1:
+            queries.append(f"What is a key feature of the {name()}?")
+        elif complexity == 2:
+            queries.append(f"Compare the {name()} and the {name()}: which is better for {rng.choice(USES)}, and why?")
+        else:
+            queries.append(f"Please suggest three products for {rng.choice(USES)} with {rng.choice(FEATURES)} and tell me why. "
+                           f"Give this back to me in markdown code as a table, with a summary below outlining why {rng.choice(FEATURES)} matters, "
+                           f"and say how the {name()} compares.")
+    return queries
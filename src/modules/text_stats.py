@@ -0,0 +1,19 @@
+import re
+
+# Cheap, dependency-free text measures shared by the estimators, the local relevance and grading
+# heuristics and the fake backend
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+STOP_WORDS = {"the", "a", "an", "of", "and", "or", "is", "are", "what", "which", "how", "to", "in", "for", "on", "with", "does", "do", "it", "this", "that", "be", "as", "by", "at", "me", "please"}
+
+def count_tokens(text):
+    # Roughly matches BPE counts for English: one token per word or punctuation mark
+    return len(WORD_RE.findall(text))
+
+def content_words(text):
+    return {w for w in re.findall(r"\w+", text.lower()) if w not in STOP_WORDS}
+
+def overlap(a, b):
+    """Fraction of the content words of a that also appear in b."""
+    words = content_words(a)
+    return len(words & content_words(b)) / len(words) if words else 0.0
@@ -0,0 +1,22 @@
+from functools import lru_cache
+from modules.text_stats import count_tokens as approx_count_tokens
+from modules.set_model import llm_model
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    # tiktoken ships with langchain_openai; offline or without it, fall back to the approximation
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def count_tokens(text, model=None):
+    """Counts the tokens of text with the model's tokenizer, or approximates it when unavailable."""
+    encoding = _encoding(model or llm_model())
+    if encoding is None:
+        return approx_count_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
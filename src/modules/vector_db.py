@@ -1,18 +1,119 @@
 import os
-from langchain_community.document_loaders import CSVLoader
-from langchain_community.vectorstores import Chroma
+import json
+from modules.backend import backend_name
+from modules.numpy_store import NumpyVectorStore
+from modules.eval_set_store import file_hash, text_hash
+from modules.catalog import CatalogReader
+from modules.profiling import profile_phase
+
+# Rows are embedded in batches so large catalogs stay within the vector store's request limits
+EMBED_BATCH_SIZE = 1000
+
+def vector_store_name():
+    # "chroma" (default) or the in-process "numpy" store
+    return os.getenv("VECTOR_STORE", "chroma").lower()
 
 def vct_db_filename_gen(file_path):
     # Derive vector DB filename from CSV filename
     base_name = os.path.basename(file_path)
-    db_file_name = os.path.splitext(base_name)[0] + ".vecdb"
+    # Keep non-OpenAI embeddings and other stores apart, e.g. OutdoorClothingCatalog_1000.fake.numpy.vecdb
+    backend = "" if backend_name() == "openai" else "." + backend_name()
+    store = "" if vector_store_name() == "chroma" else "." + vector_store_name()
+    db_file_name = os.path.splitext(base_name)[0] + backend + store + ".vecdb"
 
     return os.path.join(os.path.dirname(file_path), db_file_name)
 
+def manifest_path_gen(db_file_path):
+    return os.path.join(db_file_path, "manifest.json")
+
+def load_manifest(db_file_path):
+    manifest_path = manifest_path_gen(db_file_path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as file:
+        return json.load(file)
+
+def save_manifest(db_file_path, manifest):
+    manifest_path = manifest_path_gen(db_file_path)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+
+def csv_stat(file_path):
+    stat = os.stat(file_path)
+    return {"csv_size": stat.st_size, "csv_mtime_ns": stat.st_mtime_ns}
+
+def is_vector_db_fresh(file_path, manifest, db_file_path=None):
+    """
+    Checks whether the index in the manifest was built from the CSV as it is now.
+    Size and mtime decide it without reading the file; only if they moved is the CSV hashed.
+    When the hash still matches (the file was touched or copied), the new size and mtime are
+    saved to the manifest at db_file_path, so the next check is a stat again.
+    """
+    if manifest is None:
+        return False
+    stat = csv_stat(file_path)
+    if all(manifest.get(k) == v for k, v in stat.items()):
+        return True
+    if manifest.get("csv_hash") != file_hash(file_path):
+        return False
+    if db_file_path is not None:
+        save_manifest(db_file_path, {**manifest, **stat})
+    return True
+
+def sync_vector_db(db, file_path, manifest):
+    """
+    Brings the vector DB in line with the CSV, embedding only added or modified rows and
+    deleting removed ones. Rows are identified by a hash of their content.
+    Returns the updated manifest.
+    """
+    if manifest is None:
+        # Index built before manifests existed: hash what it already holds rather than re-embed
+        stored = db.get(include=["documents"])
+        rows = {text_hash(doc): id for id, doc in zip(stored["ids"], stored["documents"])}
+    else:
+        rows = manifest["rows"]
+
+    # Stream the catalog once for the hashes, then read back only the rows to embed
+    catalog = CatalogReader(file_path)
+    row_numbers = {}
+    with profile_phase("csv_load"):
+        for doc in catalog.lazy_load():
+            row_numbers.setdefault(text_hash(doc.page_content), doc.metadata["row"])
+
+    added = [h for h in row_numbers if h not in rows]
+    removed = [h for h in rows if h not in row_numbers]
+    print(f"Vector DB sync: {len(added)} rows to embed, {len(removed)} to delete, {len(row_numbers) - len(added)} unchanged")
+
+    if removed:
+        db.delete(ids=[rows[h] for h in removed], persist=False)
+    for start in range(0, len(added), EMBED_BATCH_SIZE):
+        batch = added[start:start + EMBED_BATCH_SIZE]
+        with profile_phase("csv_load"):
+            documents = [catalog[row_numbers[h]] for h in batch]
+        db.add_documents(documents, ids=batch, persist=False)
+    if isinstance(db, NumpyVectorStore):
+        # Chroma writes as it goes; the NumPy store writes its files once
+        db.persist()
+
+    rows = {h: rows.get(h, h) for h in row_numbers}
+    return {"csv_hash": file_hash(file_path), **csv_stat(file_path), "rows": rows}
+
+def open_vector_db(db_file_path, embedding):
+    """Opens (or starts) the vector store selected by VECTOR_STORE at db_file_path."""
+    if vector_store_name() == "numpy":
+        # VECTOR_DTYPE=float16 halves the index size
+        return NumpyVectorStore(embedding, persist_directory=db_file_path, dtype=os.getenv("VECTOR_DTYPE", "float32"))
+    from langchain_community.vectorstores import Chroma
+    return Chroma(persist_directory=db_file_path, embedding_function=embedding)
+
 def check_and_load_vector_db(file_path, embedding):
     """
-    Checks if a vector db file exists for the given file_path, 
+    Checks if a vector db file exists for the given file_path,
     loads it if exists, otherwise creates it from the csv and saves it.
+    A manifest of row content hashes is kept alongside the index, so when the csv
+    changes only the affected rows are re-embedded.
     """
     # Derive vector DB filename from CSV filename
     db_file_path = vct_db_filename_gen(file_path)
@@ -20,14 +121,17 @@ def check_and_load_vector_db(file_path, embedding):
     # Check if the vector DB file exists
     if os.path.exists(db_file_path):
         print(f"Loading existing vector DB from {db_file_path}")
-        db = Chroma(persist_directory=db_file_path, embedding_function=embedding)
+        db = open_vector_db(db_file_path, embedding)
+        manifest = load_manifest(db_file_path)
+        if not is_vector_db_fresh(file_path, manifest, db_file_path):
+            print(f"Vector DB is stale. Updating from {file_path}")
+            save_manifest(db_file_path, sync_vector_db(db, file_path, manifest))
     else:
         print(f"Vector DB not found. Creating from {file_path}")
-        # Load the CSV and create the vector DB
-        loader = CSVLoader(file_path=file_path)
-        documents = loader.load()
-        # Save the newly created vector DB
-        db = Chroma.from_documents(documents, embedding, persist_directory=db_file_path)
+        # Create the vector DB, with the row content hashes as ids
+        db = open_vector_db(db_file_path, embedding)
+        os.makedirs(db_file_path, exist_ok=True)
+        save_manifest(db_file_path, sync_vector_db(db, file_path, {"rows": {}}))
         print(f"Saved new vector DB to {db_file_path}")
-    
-    return db
\ No newline at end of file
+
+    return db